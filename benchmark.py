@@ -0,0 +1,913 @@
+"""
+Benchmark
+
+Description: Time the vectorized preprocessing steps against the per-row
+loops they replaced and check that both give the same output.
+
+Args [optional]: (number of rows)
+"""
+
+import sys
+import time
+import datetime
+import random
+import numpy as np
+import pandas as pd
+import warnings
+from collections import defaultdict
+
+import preprocessor
+import merger
+
+# ignore warnings
+warnings.filterwarnings('ignore')
+
+
+def time_call(func, *args):
+    # run the function and time it
+    start = time.perf_counter()
+    result = func(*args)
+    seconds = time.perf_counter() - start
+    
+    return result, seconds
+    
+    
+    
+    
+def report(name, legacy_time, new_time, same):
+    # print the timings and if the outputs match
+    print(name)
+    print("  legacy loop (s):", round(legacy_time, 4))
+    print("  vectorized (s): ", round(new_time, 4))
+    if new_time > 0:
+        print("  speedup:        ", round(legacy_time / new_time, 1), "x")
+    print("  identical output:", same, end='\n\n')
+    
+    
+    
+
+def sample_history_dates(rows):
+    # M/D/YY dates like the 'Date' column of a HIST sheet (after the DoW split)
+    # with the '99' year sentinel and malformed values mixed in
+    dates = []
+    for i in range(rows):
+        r = random.random()
+        if r < 0.02:
+            dates.append('9/9/99')
+        elif r < 0.03:
+            dates.append(random.choice(['', 'bad', '1/2', np.nan, '1/1/ab', '1/2/23 ', '//', '12/31/2023']))
+        else:
+            dates.append(str(random.randint(1, 12)) + '/' + str(random.randint(1, 28)) + '/' \
+                         + str(random.randint(20, 24)))
+    
+    return pd.Series(dates, dtype='object')
+    
+    
+    
+    
+def legacy_convert_history_dates(dates):
+    # the per-row loop make_history_dataframe used before vectorizing
+    new_dates = dates.copy()
+    
+    default_date = '99999999'
+    for i in range(len(new_dates)):
+        # try to reformat the date
+        try:
+            old_date = new_dates.iloc[i].split('/')
+            
+            # concat year
+            if old_date[2] == '99':
+                new_date = default_date
+            else:
+                new_date = '20' + old_date[2]
+                
+                # concat month
+                if len(old_date[0]) < 2:
+                    new_date = new_date + '0' + old_date[0]
+                else:
+                    new_date = new_date + old_date[0]
+                
+                # concat day
+                if len(old_date[1]) < 2:
+                    new_date = new_date + '0' + old_date[1]
+                else:
+                    new_date = new_date + old_date[1]
+        except:
+            # if error reformating date, set to default
+            new_date = default_date
+            
+        new_dates.iloc[i] = new_date
+        
+    return new_dates
+    
+    
+    
+    
+def bench_history_dates(rows):
+    dates = sample_history_dates(rows)
+    
+    legacy, legacy_time = time_call(legacy_convert_history_dates, dates)
+    new, new_time = time_call(preprocessor.convert_history_dates, dates)
+    
+    # the loop kept malformed dates like '20ab0101' as they are, they are
+    # the default date now
+    legacy = legacy.where(legacy.str.fullmatch(r'\d{8}'), '99999999')
+    
+    same = legacy.astype('int32').equals(new)
+    report("HIST date normalization (" + str(rows) + " rows)", legacy_time, new_time, same)
+    
+    return same
+
+
+
+
+def sample_history_codes(rows):
+    # raw station/driver codes and reasons like a built history dataframe
+    codes = [0, 1, 2, 3, 10, 12, 16, 40, 85, 300, 301, 999]
+    reasons = [0, 1, 2, 5, 6, 73, 74, 99]
+    df = pd.DataFrame({'station_code' : np.random.choice(codes, rows), \
+                       'driver_code' : np.random.choice(codes, rows), \
+                       'reason' : np.random.choice(reasons, rows)})
+    
+    return df
+    
+    
+    
+    
+def legacy_recode_history(df_history):
+    # the dictionary/itertuples recoding clean_data used before vectorizing
+    df = df_history.copy()
+    
+    # Sub recodes List
+    sub_recode_dict = {1: 1, 2: 2, 3: 3, 4: 4, 5: 5, 6: 73, 7: 74}
+    
+    # Use default_dict so that codes other than recodes default to 0
+    default_sub_dict = defaultdict(lambda: 0)
+    for k, v in sub_recode_dict.items():
+        default_sub_dict[v] = k
+        
+    # do the sub recoding
+    for row in df_history.itertuples():
+        if row.driver_code == 2:
+            new_code = default_sub_dict[row.reason]
+            df.at[row.Index, 'reason'] = new_code
+        else:
+            df.at[row.Index, 'reason'] = 0
+
+    # Recodes List
+    recode_dict = {1: {1, 4, 7, 11, 36, 57, 59, 82, 83}, 2: {15, 34, 47, 94, 100}, 3: {40, 300},
+                   4: {33, 35, 42, 43, 51, 52, 53, 54, 56, 63, 67, 68}, 5: {12, 16, 27, 37},
+                   6: {2, 3, 17}, 7: {85}, 8: {6, 81}, 9: {10}}
+
+    # Use default_dict so that codes other than recodes default to 0
+    default_dict = defaultdict(lambda: 0)
+    for k, v in recode_dict.items():
+        for vv in v:
+            default_dict[vv] = k
+
+    # Do the recoding
+    for col in ["driver_code", "station_code"]:
+        df[col] = df[col].astype(int).apply(lambda x: default_dict[x])
+
+    return df
+    
+    
+    
+    
+def bench_recode_history(rows):
+    df = sample_history_codes(rows)
+    
+    legacy, legacy_time = time_call(legacy_recode_history, df)
+    new, new_time = time_call(preprocessor.recode_history, df)
+    
+    same = legacy.astype('int64').equals(new.astype('int64'))
+    report("Station/driver code recoding (" + str(rows) + " rows)", legacy_time, new_time, same)
+    
+    return same
+
+
+
+
+def sample_history_packages(rows):
+    # package IDs of a built history dataframe, each package's events are
+    # mostly together but packages also reappear later, a few IDs are missing
+    packages = np.random.randint(0, max(rows // 4, 1), rows).astype('str')
+    packages = np.sort(packages)
+    packages[np.random.rand(rows) < 0.05] = packages[np.random.randint(0, rows)]
+    
+    df = pd.DataFrame({'package_id' : packages}).astype('string')
+    df.loc[np.random.rand(rows) < 0.01, 'package_id'] = pd.NA
+    for c in ['date', 'dow', 'type', 'station_code', 'driver_code', 'reason']:
+        df[c] = 0
+    
+    return df
+    
+    
+    
+    
+def legacy_index_history(df_history):
+    # the per-package loop build_data used before vectorizing
+    df = df_history.copy()
+    
+    # add empty column for the order of events
+    array_order = np.full((len(df)), 0, dtype='int')
+    df.insert(loc=0, column='order', value=array_order)
+    
+    # loop over individual package IDs and index history entries
+    for i in pd.unique(df['package_id']):
+        df_pkg = df[df['package_id'] == i]
+        pkg_indexer = 0
+        for j in df_pkg.index:
+            df.at[j, 'order'] = pkg_indexer
+            pkg_indexer += 1
+    
+    # reorder columns
+    column_order = ['package_id', 'order', 'date', 'dow', 'type', 'station_code', 'driver_code', 'reason']
+    df = df[column_order]
+    
+    return df
+    
+    
+    
+    
+def bench_index_history(rows):
+    df = sample_history_packages(rows)
+    
+    # the build keys the package IDs before indexing, missing IDs get key -1
+    keys, ids = pd.factorize(df['package_id'])
+    df_keyed = df.rename(columns={'package_id' : 'package_key'})
+    df_keyed['package_key'] = keys.astype('int32')
+    
+    legacy, legacy_time = time_call(legacy_index_history, df)
+    new, new_time = time_call(preprocessor.index_history, df_keyed)
+    
+    # the order column is int32 now, compare the values
+    same = legacy['order'].astype('int32').equals(new['order'])
+    report("History event ordering (" + str(rows) + " rows)", legacy_time, new_time, same)
+    
+    return same
+
+
+
+
+def sample_master(rows):
+    # a merged master dataframe: packages with interleaved rows, codes,
+    # PLD data, daily package counts and weather on some of the rows
+    packages = max(rows // 10, 1)
+    keys = np.sort(np.random.randint(0, packages, rows))
+    keys = keys[np.argsort(keys + np.random.rand(rows) * 3, kind='stable')]
+    
+    df = pd.DataFrame({'package_key' : keys.astype('int32'), \
+                       'date' : np.random.randint(20230301, 20230310, rows).astype('int32'), \
+                       'status' : pd.Categorical(np.random.choice(['S', 'D', 'X'], rows, p=[0.8, 0.15, 0.05])), \
+                       'station_code' : np.random.choice(np.arange(10), rows, p=[0.5] + [0.5/9]*9).astype('int8'), \
+                       'driver_code' : np.random.choice(np.arange(10), rows, p=[0.6] + [0.4/9]*9).astype('int8'), \
+                       'reason' : np.random.choice(np.arange(8), rows, p=[0.7] + [0.3/7]*7).astype('int8'), \
+                       'provider' : pd.Categorical(np.random.choice(['', 'A', 'B', 'None'], rows)), \
+                       'assigned_area' : np.random.choice([0, 0, 101, 102, 1020], rows).astype('int16'), \
+                       'zipcode' : np.random.choice([0, 0, 65604, 65590, 65608], rows).astype('int32'), \
+                       'total_day_pkgs' : np.random.choice([0, 0, 0, 120, 133, 150], rows), \
+                       'precip' : np.where(np.random.rand(rows) < 0.4, np.random.rand(rows).round(2) * 2, 0.0), \
+                       'snow' : np.where(np.random.rand(rows) < 0.2, np.random.rand(rows).round(1), 0.0), \
+                       'temp' : np.random.randint(1, 95, rows)})
+    
+    return df
+    
+    
+    
+    
+def legacy_compress(df_master):
+    # the per-package loop merger.compress used before the grouped engine
+    df = df_master.copy()
+    dataframe_list = []
+    
+    for i in pd.unique(df_master['package_key']):
+        pkg = []
+        df_pkg = df_master[df_master['package_key'] == i]
+        
+        # key, class label and days at the station
+        pkg.append(df_pkg['package_key'].iloc[0])
+        pkg.append(df_pkg['status'].iloc[len(df_pkg)-1] == 'D')
+        pkg.append(len(pd.unique(df_pkg['date'])))
+        
+        # last distinct zipcode, provider and area
+        zips = [x for x in pd.unique(df_pkg['zipcode']) if x != 0]
+        pkg.append(zips[len(zips)-1] if zips else 0)
+        provider = [x for x in pd.unique(df_pkg['provider']) if x != '']
+        pkg.append(provider[len(provider)-1] if provider else 'None')
+        area = [x for x in pd.unique(df_pkg['assigned_area']) if x != 0]
+        pkg.append(area[len(area)-1] if area else 0)
+        
+        # station code counts, then driver code counts
+        s_codes = df_pkg['station_code'].value_counts()
+        d_codes = df_pkg['driver_code'].value_counts()
+        if 0 in s_codes:
+            s_codes = s_codes.drop(0)
+        if 0 in d_codes:
+            d_codes = d_codes.drop(0)
+        s_codes = s_codes.to_dict()
+        d_codes = d_codes.to_dict()
+        for v in d_codes:
+            if v not in s_codes:
+                s_codes[v] = d_codes[v]
+        codes = {1:0, 2:0, 3:0, 4:0, 5:0, 6:0, 7:0, 8:0, 9:0}
+        for v in s_codes:
+            codes[v] = s_codes[v]
+        
+        # delays, failures, address and resolution
+        pkg.append(codes[1])
+        pkg.append(codes[5] + codes[7] + codes[9])
+        if codes[6] > 0:
+            reason = pd.unique(df_pkg['reason'])
+            pkg.append(reason[len(reason)-1] if reason.any() else 8)
+        else:
+            pkg.append(0)
+        pkg.append(codes[3] > 0)
+        
+        # volume, precipitation and temperature
+        pkg_counts = pd.unique(df_pkg[df_pkg['total_day_pkgs'] != 0].total_day_pkgs)
+        try:
+            pkg_mean = round(np.mean(pkg_counts))
+        except:
+            pkg_mean = round(np.mean(pd.unique(df.total_day_pkgs)))
+        pkg.append(pkg_mean)
+        pkg.append(np.sum(df_pkg.precip) + np.sum(df_pkg.snow))
+        pkg.append(int(np.mean(pd.unique(df_pkg[df_pkg['temp'] != 0].temp))))
+        
+        dataframe_list.append(pkg)
+    
+    df = pd.DataFrame(dataframe_list, columns=['package_key', 'delivered', 'days', 'zipcode', \
+                                               'provider', 'area', 'delays', 'failures', 'address', \
+                                               'resolution', 'volume', 'precip', 'temp'])
+    
+    return df
+    
+    
+    
+    
+def bench_compress(rows):
+    df = sample_master(rows)
+    
+    legacy, legacy_time = time_call(legacy_compress, df)
+    new, new_time = time_call(merger.compress, df)
+    
+    # compare the values, the grouped engine keeps the compact column types
+    same = legacy.astype('str').equals(new.astype('str'))
+    report("Master compression (" + str(rows) + " rows)", legacy_time, new_time, same)
+    
+    return same
+
+
+
+
+def sample_aggregate():
+    # the daily package counts of every provider, some days missing
+    dates = [d for d in range(20230301, 20230310) if d != 20230305]
+    providers = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'J', 'K']
+    
+    df = pd.DataFrame({'date' : np.repeat(dates, len(providers)).astype('int32'), \
+                       'provider' : pd.Series(providers * len(dates), dtype='string'), \
+                       'pkg_counts' : np.random.randint(0, 60, len(dates) * len(providers))})
+    
+    return df
+
+
+
+
+def legacy_add_aggregate(df_master, df_aggregate):
+    # the per-package, per-date loop of merger.add_aggregate
+    df = df_master.copy()
+    total_count_array = np.full(len(df), 0, dtype='int')
+    
+    for i in pd.unique(df_master['package_key']):
+        df_pkg = df[df['package_key'] == i]
+        
+        for d in pd.unique(df_pkg['date']):
+            df_agg = df_aggregate[df_aggregate['date'] == d]
+            total_pkgs = sum(df_agg['pkg_counts'])
+            
+            row = df.index.get_loc(df_pkg[df_pkg['date'] == d].index[0])
+            total_count_array[row] = total_pkgs
+    
+    df.insert(loc=len(df.columns), column='total_day_pkgs', value=total_count_array)
+    
+    return df
+
+
+
+
+def bench_add_aggregate(rows):
+    df = sample_master(rows).drop(columns='total_day_pkgs')
+    df_aggregate = sample_aggregate()
+    
+    legacy, legacy_time = time_call(legacy_add_aggregate, df, df_aggregate)
+    new, new_time = time_call(merger.add_aggregate, df, df_aggregate)
+    
+    same = legacy.equals(new)
+    report("Daily package counts (" + str(rows) + " rows)", legacy_time, new_time, same)
+    
+    return same
+
+
+
+
+def sample_weather():
+    # one weather row for every day of the sample master dataframe
+    dates = np.arange(20230301, 20230310).astype('int32')
+    
+    df = pd.DataFrame({'date' : dates, \
+                       'precip' : np.random.rand(len(dates)).round(2), \
+                       'snow' : np.random.rand(len(dates)).round(1), \
+                       'temp' : np.random.randint(1, 95, len(dates)), \
+                       'fog' : np.random.randint(0, 2, len(dates))})
+    
+    return df
+
+
+
+
+def legacy_add_weather(df_master, df_weather):
+    # the per-package, per-date loop of merger.add_weather
+    df = df_master.copy()
+    arrays = {'precip' : np.full(len(df), 0.0, dtype='float'), \
+              'snow' : np.full(len(df), 0.0, dtype='float'), \
+              'temp' : np.full(len(df), 0, dtype='int'), \
+              'fog' : np.full(len(df), 0, dtype='int')}
+    
+    for i in pd.unique(df_master['package_key']):
+        df_pkg = df[df['package_key'] == i]
+        
+        for d in pd.unique(df_pkg['date']):
+            weather = df_weather[df_weather['date'] == d]
+            
+            row = df.index.get_loc(df_pkg[df_pkg['date'] == d].index[0])
+            for name in arrays:
+                arrays[name][row] = weather[name].values[0]
+    
+    for name in arrays:
+        df.insert(loc=len(df.columns), column=name, value=arrays[name])
+    
+    return df
+
+
+
+
+def bench_add_weather(rows):
+    df = sample_master(rows).drop(columns=['precip', 'snow', 'temp'])
+    df_weather = sample_weather()
+    
+    legacy, legacy_time = time_call(legacy_add_weather, df, df_weather)
+    new, new_time = time_call(merger.add_weather, df, df_weather)
+    
+    same = legacy.equals(new)
+    report("Daily weather (" + str(rows) + " rows)", legacy_time, new_time, same)
+    
+    return same
+
+
+
+
+def legacy_build_master(df_history, df_aggregate, df_weather):
+    # the chain of full master dataframes the fused builder replaces
+    df = legacy_add_aggregate(df_history, df_aggregate)
+    df = legacy_add_weather(df, df_weather)
+    df = legacy_compress(df)
+    
+    return df
+
+
+
+
+def bench_build_master(rows):
+    df = sample_master(rows).drop(columns=['total_day_pkgs', 'precip', 'snow', 'temp'])
+    df_aggregate = sample_aggregate()
+    df_weather = sample_weather()
+    
+    legacy, legacy_time = time_call(legacy_build_master, df, df_aggregate, df_weather)
+    new, new_time = time_call(merger.build_master, df, df_aggregate, df_weather)
+    
+    same = legacy.astype('str').equals(new.astype('str'))
+    report("Fused master build (" + str(rows) + " rows)", legacy_time, new_time, same)
+    
+    return same
+
+
+
+
+def sample_clean_history(rows):
+    # a merged history: packages with their event order and dates, some of
+    # them with one event, dates outside of the date range or no order 0
+    keys = np.sort(np.random.randint(0, max(rows // 5, 1), rows)).astype('int32')
+    keys[np.random.rand(rows) < 0.01] = -1
+    
+    order = pd.Series(keys).groupby(keys).cumcount().values.astype('int32')
+    shifted = np.random.rand(keys.max() + 2) < 0.03
+    order = order + shifted[keys].astype('int32')
+    
+    dates = np.random.randint(20230301, 20230310, rows)
+    dates[np.random.rand(rows) < 0.005] = 20230228
+    dates[np.random.rand(rows) < 0.005] = 20230310
+    
+    df = pd.DataFrame({'package_key' : keys, 'order' : order, 'date' : dates.astype('int32')})
+    
+    return df
+
+
+
+
+def legacy_filter_packages(df_history):
+    # the three package loops clean_data ran one after another, the missing
+    # package IDs (key -1) never matched themselves and were never removed
+    df = df_history.copy()
+    packages = pd.unique(df['package_key'][df['package_key'] >= 0])
+    
+    # remove packages with one history entry or less
+    for i in packages:
+        df_pkg = df[df['package_key'] == i]
+        if len(df_pkg) <= 1:
+            df = df.drop(df_pkg.index, axis=0)
+    df = df.reset_index(drop=True)
+    
+    # remove packages with dates outside of the date range
+    start_date = preprocessor.get_start_date()
+    end_date = preprocessor.get_end_date()
+    for i in packages:
+        df_pkg = df[df['package_key'] == i]
+        for d in df_pkg['date']:
+            pkg_date = preprocessor.str_to_date(str(d))
+            if pkg_date < start_date or pkg_date > end_date:
+                df = df.drop(df_pkg.index, axis=0)
+                break
+    df = df.reset_index(drop=True)
+    
+    # remove packages without order 0
+    for i in packages:
+        df_pkg = df[df['package_key'] == i]
+        if 0 not in df_pkg['order'].values:
+            df = df.drop(df_pkg.index, axis=0)
+    df = df.reset_index(drop=True)
+    
+    return df
+
+
+
+
+def bench_filter_packages(rows):
+    df = sample_clean_history(rows)
+    preprocessor.set_start_date(datetime.date(2023, 3, 1))
+    preprocessor.set_end_date(datetime.date(2023, 3, 9))
+    
+    legacy, legacy_time = time_call(legacy_filter_packages, df)
+    (new, counts), new_time = time_call(preprocessor.filter_packages, df)
+    
+    same = legacy.equals(new)
+    report("Package filter (" + str(rows) + " rows)", legacy_time, new_time, same)
+    
+    return same
+
+
+
+
+def legacy_truncate_pkg_history(df_history):
+    # the per-package query and drop of truncate_pkg_history, the missing
+    # package IDs (key -1) never matched themselves
+    df = df_history.copy()
+    
+    for i in pd.unique(df_history['package_key'][df_history['package_key'] >= 0]):
+        df_pkg = df_history[df_history['package_key'] == i]
+        
+        if 'Delivery' in df_pkg['type'].values:
+            pkg_delivery = df_pkg.query("type=='Delivery'")['order'].values
+            last_delivery = pkg_delivery[len(pkg_delivery)-1]
+            
+            index_after_delivery = df_pkg[df_pkg['order'] > last_delivery].index
+            df = df.drop(index_after_delivery, axis=0)
+    
+    df = df.reset_index(drop=True)
+    
+    return df
+
+
+
+
+def bench_truncate_history(rows):
+    df = sample_clean_history(rows)
+    df['type'] = pd.Categorical(np.random.choice(['Status Code', 'Delivery'], rows, p=[0.8, 0.2]))
+    
+    legacy, legacy_time = time_call(legacy_truncate_pkg_history, df)
+    new, new_time = time_call(preprocessor.truncate_pkg_history, df)
+    
+    same = legacy.equals(new)
+    report("History truncation (" + str(rows) + " rows)", legacy_time, new_time, same)
+    
+    return same
+
+
+
+
+def legacy_type_to_status(df_history):
+    # the per-package loop of type_to_status, the missing package IDs
+    # (key -1) never matched themselves
+    df = df_history.rename(columns={'type' : 'status'})
+    df['status'] = df['status'].astype('object')
+    df['status'] = df['status'].str.replace('Status Code', 'S')
+    df['status'] = df['status'].str.replace('Delivery', 'D')
+    
+    for i in pd.unique(df_history['package_key'][df_history['package_key'] >= 0]):
+        df_pkg = df[df['package_key'] == i]
+        
+        if 'D' not in df_pkg['status'].values:
+            df.at[df_pkg.index[len(df_pkg.index)-1], 'status'] = 'X'
+    
+    return df
+
+
+
+
+def bench_type_to_status(rows):
+    df = sample_clean_history(rows)
+    df['type'] = pd.Categorical(np.random.choice(['Status Code', 'Delivery'], rows, p=[0.9, 0.1]))
+    
+    legacy, legacy_time = time_call(legacy_type_to_status, df)
+    new, new_time = time_call(preprocessor.type_to_status, df)
+    
+    # the statuses stay categorical now, compare the values
+    same = legacy.equals(new.astype({'status' : 'object'}))
+    report("No delivery status (" + str(rows) + " rows)", legacy_time, new_time, same)
+    
+    return same
+
+
+
+
+def sample_history_sheet_codes(rows, reasons=True):
+    # raw 'Station Code' and 'Driver Code' cells of a HIST sheet, without any
+    # reason token on the driver codes when reasons is False
+    station = ['85\xa0\xa0Missing', '---', '2\xa0\xa0Addr', '07\xa0\xa0x', '1\xa0\xa0Late', \
+               '40\xa0\xa0Res', '12\xa0\xa0F', '300\xa0\xa0Q', '10\xa0\xa0Z']
+    driver = ['---', '02\xa0\xa073', '2\xa0\xa01', '02\xa0\xa0---', '16\xa0\xa0---', \
+              '40\xa0\xa0---', '2\xa0\xa074', '10\xa0\xa0---']
+    if not reasons:
+        driver = ['---', '16', '40', '10', '2']
+    
+    df = pd.DataFrame({'Station Code' : np.random.choice(station, rows), \
+                       'Driver Code' : np.random.choice(driver, rows)})
+    
+    return df
+
+
+
+
+def legacy_split_codes(df):
+    # the split/replace/strip passes make_history_dataframe used before the regex
+    station_split = df['Station Code'].str.replace('\xa0\xa0', ' ')
+    station_split = station_split.str.split(' ', n=1, expand=True)
+    station_split = station_split.drop(1, axis=1)
+    station_split = station_split.rename(columns={0 : 'Station Code'})
+    station_split.loc[station_split['Station Code'] == '---', 'Station Code'] = '0'
+    for i in station_split.columns:
+        station_split[i] = station_split[i].str.replace('[a-zA-Z]', '', regex=True)
+        station_split[i] = station_split[i].fillna(0)
+        station_split[i] = station_split[i].astype('int')
+    
+    driver_split = df['Driver Code'].str.replace('\xa0\xa0', ' ')
+    driver_split = driver_split.str.split(' ', n=1, expand=True)
+    driver_split = driver_split.rename(columns={0 : 'Driver Code', 1 : 'Reason'})
+    driver_split.loc[driver_split['Driver Code'] == '---', 'Driver Code'] = '0'
+    driver_split.loc[driver_split['Reason'] == '---', 'Reason'] = '0'
+    for i in driver_split.columns:
+        driver_split[i] = driver_split[i].str.replace('[a-zA-Z]', '', regex=True)
+        driver_split[i] = driver_split[i].fillna(0)
+        driver_split[i] = driver_split[i].astype('int')
+    
+    codes = pd.DataFrame({'station_code' : station_split['Station Code'], \
+                          'driver_code' : driver_split['Driver Code'], \
+                          'reason' : driver_split['Reason']})
+    
+    return codes
+
+
+
+
+def parse_codes(df):
+    # the regex parsing of make_history_dataframe
+    station_split = preprocessor.parse_history_codes(df['Station Code'], preprocessor.STATION_CODE_REGEX)
+    driver_split = preprocessor.parse_history_codes(df['Driver Code'], preprocessor.DRIVER_CODE_REGEX)
+    
+    codes = pd.DataFrame({'station_code' : station_split[0], \
+                          'driver_code' : driver_split[0], \
+                          'reason' : driver_split[1]})
+    
+    return codes
+
+
+
+
+def bench_history_code_parsing(rows):
+    df = sample_history_sheet_codes(rows)
+    
+    legacy, legacy_time = time_call(legacy_split_codes, df)
+    new, new_time = time_call(parse_codes, df)
+    
+    same = legacy.astype('int64').equals(new.astype('int64'))
+    report("Station/driver code parsing (" + str(rows) + " rows)", legacy_time, new_time, same)
+    
+    # a sheet without any reason token failed with KeyError('Reason') before,
+    # its rows are kept now with reason 0 and the same station/driver codes
+    df = sample_history_sheet_codes(rows, reasons=False)
+    new = parse_codes(df)
+    try:
+        legacy_split_codes(df)
+        failed = False
+    except KeyError:
+        failed = True
+    
+    codes = df['Driver Code'].replace('---', '0').astype('int64')
+    parsed = failed and codes.equals(new['driver_code'].astype('int64')) and bool((new['reason'] == 0).all())
+    print("Driver codes without reasons (" + str(rows) + " rows)")
+    print("  legacy split failed:", failed)
+    print("  parsed with reason 0:", parsed, end='\n\n')
+    
+    return same and parsed
+
+
+
+
+def sample_split_history(rows, days):
+    # a cleaned history of packages seen on one of the days with its keys,
+    # package data, aggregate and weather, the aggregate misses a day
+    df = sample_master(rows).drop(columns=['total_day_pkgs', 'precip', 'snow', 'temp'])
+    keys = df['package_key'].values
+    packages = keys.max() + 1
+    dates = pd.date_range('2023-03-01', periods=days).strftime('%Y%m%d').astype('int32').values
+    df['date'] = dates[keys.astype('int64') * days // packages]
+    
+    # every package has one zipcode, the area of the zipcode is missing on some rows
+    zipcodes = np.array([65604, 65590, 65608, 65610, 65611, 65609, 64738, 65742, \
+                         65714, 65636, 65605, 65622, 65614, 65631, 65615, 65626])
+    df['zipcode'] = zipcodes[keys % len(zipcodes)].astype('int32')
+    areas = df['zipcode'].values % 1000
+    df['assigned_area'] = np.where(np.random.rand(rows) < 0.3, 0, areas).astype('int16')
+    df.insert(loc=df.columns.get_loc('assigned_area') + 1, column='loaded_area', value=np.int16(0))
+    
+    df_keys = pd.DataFrame({'package_id' : ['P%06d' % k for k in range(packages)], \
+                            'package_key' : np.arange(packages, dtype='int32')})
+    df_package = pd.DataFrame({'package_key' : df_keys['package_key'], \
+                               'service' : np.random.choice(['S', 'E'], packages), \
+                               'signature' : np.random.choice(['Y', 'N'], packages)})
+    
+    providers = ['A', 'B', 'C', 'D']
+    counted = np.delete(dates, 4)
+    df_aggregate = pd.DataFrame({'date' : np.repeat(counted, len(providers)), \
+                                 'provider' : pd.Series(providers * len(counted), dtype='string'), \
+                                 'pkg_counts' : np.random.randint(0, 60, len(counted) * len(providers))})
+    df_weather = pd.DataFrame({'date' : dates, \
+                               'precip' : np.random.rand(days).round(2), \
+                               'snow' : np.random.rand(days).round(1), \
+                               'temp' : np.random.randint(1, 95, days), \
+                               'fog' : np.random.randint(0, 2, days)})
+    
+    return df, df_keys, df_package, df_aggregate, df_weather
+
+
+
+
+def impute_areas(df_history):
+    # fill the missing areas from a zipcode table built over the whole history,
+    # a stand-in for fix_zipcode_provider, the last area seen for a zipcode wins
+    df = df_history.copy()
+    known = df['assigned_area'].values != 0
+    zip_area = dict(zip(df['zipcode'].values[known].tolist(), df['assigned_area'].values[known].tolist()))
+    
+    areas = df['zipcode'][~known].map(zip_area).fillna(0)
+    df.loc[~known, 'assigned_area'] = areas.values.astype('int16')
+    
+    tables = {'zip_area' : zip_area, 'area_provider' : {}, 'area_zip' : {}, 'provider_zip' : {}}
+    
+    return df, tables
+
+
+
+
+def full_master(df_history, df_aggregate, df_weather, df_package, df_keys):
+    # the master dataframe of merger.main without --incremental
+    df = merger.build_master(df_history, df_aggregate, df_weather)
+    df = merger.add_package(df, df_package, df_keys)
+    df = merger.finalizer(df, df_keys)
+    
+    return df
+
+
+
+
+def merge_state(df_history, df_aggregate, df_weather):
+    # the state merger.main keeps with --incremental
+    counts = merger.volume_columns(df_history, df_aggregate, merger.first_dates(df_history))
+    state = merger.merge_state(df_aggregate, df_weather, merger.volume_fallbacks(counts))
+    
+    return state, counts
+
+
+
+
+def bench_incremental_refresh(rows):
+    days = 30
+    df_raw, df_keys, df_package, df_aggregate, df_weather = sample_split_history(rows, days)
+    split = df_weather['date'].values[-1]
+    
+    # the master dataframe, its state and the imputation tables before the last day
+    early = df_raw['date'].values < split
+    df_early, tables = impute_areas(df_raw[early])
+    df_counted = df_aggregate[df_aggregate['date'].values < split]
+    df_stored = full_master(df_early, df_counted, df_weather, df_package, df_keys)
+    state, counts = merge_state(df_early, df_counted, df_weather)
+    
+    # the last day moves the area of a zipcode, the weather of an earlier day
+    # is rebuilt and the next build hands out new keys
+    late = ~early & (df_raw['zipcode'].values == 65608) & (df_raw['assigned_area'].values != 0)
+    df_raw.loc[late, 'assigned_area'] = 1020
+    df_weather.loc[df_weather['date'] == 20230302, 'temp'] += 10
+    keys = np.random.permutation(len(df_keys)).astype('int32')
+    df_raw['package_key'] = keys[df_raw['package_key'].values]
+    df_package['package_key'] = keys[df_package['package_key'].values]
+    df_keys = df_keys.iloc[np.argsort(keys)].reset_index(drop=True)
+    df_keys['package_key'] = np.arange(len(df_keys), dtype='int32')
+    df_history, new_tables = impute_areas(df_raw)
+    
+    # the packages of the last day and of the moved table entries, the ones
+    # preprocessor.py records as touched
+    touched = set(df_keys['package_id'].values[np.unique(df_raw['package_key'].values[~early])])
+    record = {'files' : [], 'packages' : touched, 'tables' : tables}
+    record = preprocessor.update_imputed(record, new_tables, df_raw, df_keys)
+    
+    full, full_time = time_call(full_master, df_history, df_aggregate, df_weather, df_package, df_keys)
+    
+    def refresh(package_ids):
+        current, counts = merge_state(df_history, df_aggregate, df_weather)
+        package_ids = package_ids | merger.stale_packages(state, current, df_history, df_keys, counts)
+        return merger.refresh_master(df_stored, df_history, df_aggregate, df_weather, df_package, \
+                                     df_keys, package_ids, current['fallbacks'])
+    
+    new, new_time = time_call(refresh, record['packages'])
+    
+    # the packages of the last day alone miss the moved zipcode area, the
+    # rebuilt weather day and the packages with fallback volume
+    current, counts = merge_state(df_history, df_aggregate, df_weather)
+    alone = merger.refresh_master(df_stored, df_history, df_aggregate, df_weather, df_package, \
+                                  df_keys, touched, current['fallbacks'])
+    
+    refreshed = record['packages'] | merger.stale_packages(state, current, df_history, df_keys, counts)
+    
+    same = full.equals(new)
+    print("Incremental refresh (" + str(rows) + " rows, 1 of " + str(days) + " days new)")
+    print("  full build (s):  ", round(full_time, 4))
+    print("  refresh (s):     ", round(new_time, 4))
+    if new_time > 0:
+        print("  speedup:         ", round(full_time / new_time, 1), "x")
+    print("  refreshed packages:", len(refreshed), "of", len(full))
+    print("  identical output:", same)
+    print("  last day's packages alone:", full.equals(alone), end='\n\n')
+    
+    return same
+
+
+
+
+def main(args):
+    # number of rows in the sample data
+    rows = 100000
+    if len(args) > 1:
+        rows = int(args[1])
+    
+    # seed the sample data
+    random.seed(0)
+    np.random.seed(0)
+    
+    results = []
+    results.append(bench_history_dates(rows))
+    results.append(bench_recode_history(rows))
+    results.append(bench_history_code_parsing(rows))
+    
+    # the legacy per-package loops are quadratic, keep their samples small
+    results.append(bench_index_history(min(rows, 20000)))
+    results.append(bench_filter_packages(min(rows, 20000)))
+    results.append(bench_truncate_history(min(rows, 20000)))
+    results.append(bench_type_to_status(min(rows, 20000)))
+    results.append(bench_add_aggregate(min(rows, 20000)))
+    results.append(bench_add_weather(min(rows, 20000)))
+    results.append(bench_compress(min(rows, 20000)))
+    results.append(bench_build_master(min(rows, 5000)))
+    results.append(bench_incremental_refresh(rows))
+    
+    # fail loudly when a vectorized step does not match its loop
+    if not all(results):
+        print("Some vectorized steps do not match their legacy loops!")
+        sys.exit(1)
+    
+    print("All vectorized steps match their legacy loops.")
+
+
+
+
+if __name__ == "__main__":
+    main(sys.argv)
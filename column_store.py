@@ -0,0 +1,144 @@
+"""
+column_store
+
+Description: Dataframes stored as one .npy file per column. The columns are
+memory mapped when read back, so a process only pages in the rows it uses and
+the rows of a stored dataframe can be split up without loading all of them.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+
+
+def write_columns(df, path):
+    """
+    write_columns(df, path) -> None
+
+    args:
+    df (pandas dataframe) -> dataframe to store
+    path (str) -> directory of the stored columns, created if missing
+
+    Desc:
+    Save every column of the dataframe as a .npy file in the directory.
+    Numeric and boolean columns are saved as they are, categorical columns as
+    their codes and any other column as codes into its distinct values. The
+    column names, categories and distinct values are kept in meta.pkl.
+    """
+    meta = {'columns' : list(df.columns), 'categories' : {}, 'uniques' : {}}
+    columns = {}
+    for name in df.columns:
+        values = df[name]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            meta['categories'][name] = values.cat.categories
+            values = values.cat.codes.values
+        elif isinstance(values.dtype, np.dtype) and values.dtype.kind in 'biuf':
+            values = values.values
+        else:
+            codes, uniques = pd.factorize(values)
+            meta['uniques'][name] = (uniques, values.dtype)
+            values = codes
+        columns[name] = values
+
+    allocated = allocate_columns(path, meta, len(df), {name : v.dtype for name, v in columns.items()})
+    for name, values in columns.items():
+        allocated[name][:] = values
+        allocated[name].flush()
+
+
+
+
+def allocate_columns(path, meta, length, dtypes):
+    """
+    allocate_columns(path, meta, length, dtypes) -> columns (dict)
+
+    args:
+    path (str) -> directory of the stored columns, created if missing
+    meta (dict) -> column names, categories and distinct values of the columns
+    length (int) -> number of rows
+    dtypes (dict) -> stored dtype of every column
+
+    returns:
+    columns (dict) -> writable memory mapped array of every column
+
+    Desc:
+    Create the .npy file of every column with room for the given number of
+    rows, remove the files of columns no longer stored and save the
+    description of the columns. The rows are written into
+    the returned arrays, flush them once they are filled.
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    # columns stored before and not anymore
+    for file in os.listdir(path):
+        if file.endswith('.npy') and file[:-4] not in meta['columns']:
+            os.remove(os.path.join(path, file))
+
+    columns = {}
+    for name in meta['columns']:
+        columns[name] = np.lib.format.open_memmap(os.path.join(path, name + '.npy'), mode='w+', \
+                                                  dtype=dtypes[name], shape=(length,))
+
+    pd.to_pickle(meta, os.path.join(path, 'meta.pkl'))
+
+    return columns
+
+
+
+
+def open_columns(path):
+    """
+    open_columns(path) -> meta (dict), columns (dict)
+
+    args:
+    path (str) -> directory of the stored columns
+
+    returns:
+    meta (dict) -> column names, categories and distinct values of the columns
+    columns (dict) -> read only memory mapped array of every column, as stored
+
+    Desc:
+    Map the stored columns without reading them. Categorical columns and
+    columns of distinct values come back as their codes.
+    """
+    meta = pd.read_pickle(os.path.join(path, 'meta.pkl'))
+
+    columns = {}
+    for name in meta['columns']:
+        columns[name] = np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+
+    return meta, columns
+
+
+
+
+def read_columns(path):
+    """
+    read_columns(path) -> df (pandas dataframe)
+
+    args:
+    path (str) -> directory of the stored columns
+
+    returns:
+    df (pandas dataframe) -> the stored dataframe
+
+    Desc:
+    Build the stored dataframe on top of the memory mapped columns. Numeric
+    and boolean columns and the codes of categorical columns are not copied,
+    every column is its own block of the dataframe. Columns of distinct
+    values are rebuilt from their codes in memory.
+    """
+    meta, columns = open_columns(path)
+
+    for name in meta['columns']:
+        if name in meta['categories']:
+            columns[name] = pd.Categorical.from_codes(columns[name], categories=meta['categories'][name])
+        elif name in meta['uniques']:
+            uniques, dtype = meta['uniques'][name]
+            values = pd.api.extensions.take(uniques.values, columns[name], allow_fill=True)
+            columns[name] = pd.Series(values, dtype=dtype).values
+
+    df = pd.DataFrame(columns, copy=False)
+
+    return df
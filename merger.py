@@ -2,278 +2,645 @@
 merger
 
 Description: Merge all the dataframes together.
+
+Args [optional]: (number of partitions) (number of workers) (--incremental)
 """
 
 import os
 import sys
+import shutil
 import pandas as pd
 import numpy as np
 import warnings
 from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor
+
+from package_index import PackageIndex
+from column_store import write_columns, allocate_columns, open_columns, read_columns
 
 # ignore warnings
 warnings.filterwarnings('ignore')
 
+# add the average daily package count of the package's provider as a feature
+PROVIDER_VOLUME = False
 
-def compress(df_master):
-    # make a copy of the master dataframe
-    df = df_master.copy()
+# weather of the days missing from the weather data
+WEATHER_DEFAULTS = {'precip' : 0.0, 'snow' : 0.0, 'temp' : 0, 'fog' : 0}
+
+# history rows streamed into the partitions at a time
+CHUNK_ROWS = 1000000
+
+
+def last_distinct(values, slots, starts, exclude, default):
+    # the value that first appears last in every package, like the last entry of
+    # pd.unique() on the package's values once the excluded value is removed
+    first = ~pd.DataFrame({'slot' : slots, 'value' : values}).duplicated().values
+    if exclude is not None:
+        first = first & (values != exclude)
+    
+    # the last first-appearance row of every package, -1 if there is none
+    rows = np.where(first, np.arange(len(values)), -1)
+    last = np.maximum.reduceat(rows, starts)
+    
+    return np.where(last >= 0, values[last], default)
+
+
+
+
+def unique_mean(values, slots, starts, exclude):
+    # mean of every package's distinct values without the excluded value,
+    # like np.mean(pd.unique(...)), NaN for a package without any values
+    first = ~pd.DataFrame({'slot' : slots, 'value' : values}).duplicated().values
+    first = first & (values != exclude)
     
-    # create an array of all our unique package IDs
-    master_idx = pd.unique(df_master['package_id'])
+    # the values are integers, their sums are exact
+    sums = np.add.reduceat(np.where(first, values, 0).astype('int64'), starts)
+    counts = np.add.reduceat(first.astype('int64'), starts)
     
-    # create a list to hold compressed dataframe information
-    dataframe_list = []
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
     
-    # days of week dictionary
-    day_dict = {'M':0, 'T':1, 'W':2, 'R':3, 'F':4, 'S':5}
+    return means
+
+
+
+
+def package_sum(values, starts, ends):
+    # every package's sum, like np.sum() on the package's values
+    sums = np.add.reduceat(values, starts)
     
-    for i in tqdm(master_idx):
-        # initialize a list to hold compressed package
-        pkg = []
-        
-        # get a dataframe of the an individual package
-        df_pkg = df_master[df_master['package_id'] == i]
-        
-        # add the package ID
-        pkg.append(df_pkg['package_id'].iloc[0])
-        
-        # add the class label
-        class_label = df_pkg['status'].iloc[len(df_pkg)-1]
-        if class_label == 'D':
-            pkg.append(True)
-        else:
-            pkg.append(False)
-        
-        # add the days at the station
-        dates = pd.unique(df_pkg['date'])
-        pkg.append(len(dates))
-        
-        # add the zipcode
-        zips = pd.unique(df_pkg['zipcode'])
-        zips = [x for x in zips if x != 0]
-        try:
-            zipcode = zips[len(zips)-1]
-        except:
-            zipcode = 0
-        pkg.append(zipcode)
-        
-        # add the provider
-        provider = pd.unique(df_pkg['provider'])
-        provider = [x for x in provider if x !='']
-        try:
-            p = provider[len(provider)-1]
-        except:
-            p = 'None'
-        pkg.append(p)
-        
-        # add the area
-        area = pd.unique(df_pkg['assigned_area'])
-        area = [x for x in area if x != 0]
-        try:
-            a = area[len(area)-1]
-        except:
-            a = 0
-        pkg.append(a)
-            
-        # get the package codes
-        s_codes = df_pkg['station_code'].value_counts()
-        d_codes = df_pkg['driver_code'].value_counts()
-        if 0 in s_codes:
-            s_codes = s_codes.drop(0)
-        if 0 in d_codes:
-            d_codes = d_codes.drop(0)
-        
-        # convert to dictionary
-        s_codes = s_codes.to_dict()
-        d_codes = d_codes.to_dict()
-        
-        # add drive codes to station codes not in station codes
-        for v in d_codes:
-            if v not in s_codes:
-                s_codes[v] = d_codes[v]
-        
-        codes = {1:0, 2:0, 3:0, 4:0, 5:0, 6:0, 7:0, 8:0, 9:0}
-        for v in s_codes:
-            codes[v] = s_codes[v]
-            
-        # add package delays
-        pkg.append(codes[1])
-        
-        # add number of delivery failures
-        failure = codes[5] + codes[7] + codes[9]
-        pkg.append(failure)
-        
-        # SKIP WAITING PACKAGE CODES
-        # SKIP PROCESSING PACKAGE CODES
-        
-        # add if the package had an incorrect address
-        if codes[6] > 0:
-            # add address issue reason, if any
-            reason = pd.unique(df_pkg['reason'])  
-            if reason.any():
-                all_reasons = reason[reason != 0]            
-                pkg.append(reason[len(reason)-1])
-            # 8 is general address problem
-            else:
-                pkg.append(8)
-        # 0 if no address issues
-        else:
-            pkg.append(0)
-            
-        # add if there were any resolutions to package issues
-        if codes[3] > 0:
-            pkg.append(True)
-        else:
-            pkg.append(False)
-        
-        # add the average package count per day
-        pkg_counts = pd.unique(df_pkg[df_pkg['total_day_pkgs'] != 0].total_day_pkgs)
-        try:
-            pkg_mean = round(np.mean(pkg_counts))
-        except:
-            pkg_mean = round(np.mean(pd.unique(df.total_day_pkgs)))
-        pkg.append(pkg_mean)
+    # with two or less non-zero values the order of the additions does not matter,
+    # the other packages are summed by np.sum() so the float sums stay identical
+    nonzero = np.add.reduceat((values != 0).astype('int64'), starts)
+    for slot in np.flatnonzero(nonzero > 2):
+        sums[slot] = np.sum(values[starts[slot]:ends[slot]])
+    
+    return sums
+
+
+
+
+def compress(df_master, index=None):
+    # index the packages' rows, unless an index of the dataframe was given
+    if index is None:
+        index = PackageIndex(df_master['package_key'].values)
+    
+    columns = {name : df_master[name].values for name in df_master.columns}
+    
+    return compress_columns(columns, index)
+
+
+
+
+def volume_fallbacks(columns):
+    # the average of the distinct daily package counts over the whole dataframe,
+    # the volume of the packages without any counts
+    fallbacks = {}
+    for name in ['total_day_pkgs', 'provider_day_pkgs']:
+        if name in columns:
+            fallbacks[name] = round(np.mean(pd.unique(columns[name])))
+    
+    return fallbacks
+
+
+
+
+def compress_columns(columns, index, fallbacks=None):
+    # the volume fallbacks of these columns, unless they were given
+    if fallbacks is None:
+        fallbacks = volume_fallbacks(columns)
+    
+    # every package's rows sorted together, in row order (CSR layout)
+    rows = index.order
+    starts = index.offsets[:-1]
+    ends = index.offsets[1:]
+    slots = np.repeat(np.arange(len(index)), index.sizes())
+    
+    # the column values in package order
+    def column(name):
+        return columns[name][rows]
+    
+    # add the class label, the last status of the package
+    delivered = column('status')[ends-1] == 'D'
+    
+    # add the days at the station
+    first_date = ~pd.DataFrame({'slot' : slots, 'date' : column('date')}).duplicated().values
+    days = np.add.reduceat(first_date.astype('int64'), starts)
+    
+    # add the zipcode, provider and area
+    zipcode = last_distinct(column('zipcode'), slots, starts, 0, 0)
+    provider = last_distinct(np.asarray(column('provider'), dtype='object'), slots, starts, '', 'None')
+    area = last_distinct(column('assigned_area'), slots, starts, 0, 0)
+    
+    # count the package codes 1 to 9
+    code_counts = []
+    for name in ['station_code', 'driver_code']:
+        codes = column(name).astype('int64')
+        valid = (codes >= 1) & (codes <= 9)
+        counts = np.bincount(slots[valid] * 10 + codes[valid], minlength=len(index) * 10)
+        code_counts.append(counts.reshape(len(index), 10))
+    
+    # station code counts, driver code counts for the codes without station codes
+    s_codes, d_codes = code_counts
+    codes = np.where(s_codes > 0, s_codes, d_codes)
+    
+    # add package delays
+    delays = codes[:, 1]
+    
+    # add number of delivery failures
+    failures = codes[:, 5] + codes[:, 7] + codes[:, 9]
+    
+    # SKIP WAITING PACKAGE CODES
+    # SKIP PROCESSING PACKAGE CODES
+    
+    # add if the package had an incorrect address: the last distinct reason
+    # (0 included) if there is any reason, 8 (general address problem) if not
+    reasons = column('reason').astype('int64')
+    last_reason = last_distinct(reasons, slots, starts, None, 0)
+    any_reason = np.maximum.reduceat(reasons != 0, starts)
+    address = np.where(any_reason, last_reason, 8)
+    address = np.where(codes[:, 6] > 0, address, 0)
         
-        # add total amount of precipitation during package's life
-        rain = np.sum(df_pkg.precip)
-        snow = np.sum(df_pkg.snow)
-        precip = rain + snow
-        pkg.append(precip)
-            
-        # add the average temperature during the package's life
-        temp = np.mean(pd.unique(df_pkg[df_pkg['temp'] != 0].temp))
-        pkg.append(int(temp))
+    # add if there were any resolutions to package issues
+    resolution = codes[:, 3] > 0
+    
+    # add the average package count per day, the average over the whole
+    # dataframe when the package has none
+    volume_fallback = fallbacks['total_day_pkgs']
+    volume = unique_mean(column('total_day_pkgs'), slots, starts, 0)
+    volume = np.where(np.isnan(volume), volume_fallback, np.rint(volume)).astype('int64')
+    
+    # add the average package count per day of the package's provider
+    if 'provider_day_pkgs' in columns:
+        provider_fallback = fallbacks['provider_day_pkgs']
+        provider_volume = unique_mean(column('provider_day_pkgs'), slots, starts, 0)
+        provider_volume = np.where(np.isnan(provider_volume), provider_fallback, \
+                                   np.rint(provider_volume)).astype('int64')
+    
+    # add total amount of precipitation during package's life
+    rain = package_sum(column('precip').astype('float'), starts, ends)
+    snow = package_sum(column('snow').astype('float'), starts, ends)
+    precip = rain + snow
         
-        # append to compressed history list
-        dataframe_list.append(pkg)
+    # add the average temperature during the package's life, 0 without any
+    temp = unique_mean(column('temp'), slots, starts, 0)
+    temp = np.trunc(np.nan_to_num(temp)).astype('int64')
+    
+    # build the compressed dataframe, packages in order of first appearance
+    df = pd.DataFrame({'package_key' : index.keys, 'delivered' : delivered, 'days' : days, \
+                       'zipcode' : zipcode, 'provider' : provider, 'area' : area, \
+                       'delays' : delays, 'failures' : failures, 'address' : address, \
+                       'resolution' : resolution, 'volume' : volume, 'precip' : precip, \
+                       'temp' : temp})
     
-    # convert the 2D list into a dataframe
-    df = pd.DataFrame(dataframe_list, columns=['package_id', 'delivered', 'days', 'zipcode', \
-                                                  'provider', 'area',  \
-                                                  'delays', 'failures','address', \
-                                                  'resolution', \
-                                                  'volume', 'precip', 'temp'])
+    if 'provider_day_pkgs' in columns:
+        df.insert(loc=df.columns.get_loc('volume')+1, column='provider_volume', value=provider_volume)
+    
+    df = df.iloc[np.argsort(rows[starts], kind='stable')]
+    df = df.reset_index(drop=True)
     
     return df
 
 
 
-def add_package(df_master, df_package):
+
+def add_package(df_master, df_package, df_keys=None):
     # THIS FUNCTION ONLY WORKS AFTER COMPRESSION!!!
-    # make a copy of the master dataframe
-    df = df_master.copy()
-    
-    # empty arrays to be added as columns
-    service_array = np.full((len(df)), '', dtype='str')
-    sig_array = np.full((len(df)), '', dtype='str')
-    
-    # insert the columns in the new master dataframe
-    df.insert(loc=len(df.columns), column='service', value=service_array)
-    df.insert(loc=len(df.columns), column='signature', value=sig_array)
-    
-    # insert the data
-    for i in tqdm(df_master.itertuples()):
-        df.at[i.Index, 'service'] = df_package[df_package['package_id'] == i.package_id].service.values[0]
-        df.at[i.Index, 'signature'] = df_package[df_package['package_id'] == i.package_id].signature.values[0]
+    # the service and signature of every package, one row per package
+    df_attributes = df_package[df_package['package_key'] >= 0][['package_key', 'service', 'signature']]
+    
+    # join the package data on the package key
+    df = df_master.merge(df_attributes, how='left', on='package_key', validate='one_to_one', indicator=True)
+    
+    # report the packages without package data, they get no service and no signature
+    missing = (df['_merge'] == 'left_only').values
+    if missing.any():
+        print("No package data for", missing.sum(), "packages.")
+        if df_keys is not None:
+            package_ids = df_keys['package_id'].values[df['package_key'].values[missing]]
+            print("Missing packages:", ', '.join(map(str, package_ids[:10])), \
+                  '...' if len(package_ids) > 10 else '')
+    
+    df = df.drop(columns='_merge')
+    df['service'] = df['service'].fillna('')
         
     # convert signature to boolean values
-    df['signature'] = df['signature'].apply(lambda x: True if x == 'Y' else False)
+    df['signature'] = (df['signature'] == 'Y').values
                 
     return df
+
+
+
+
+def daily_volume(df_aggregate):
+    # total package count of every day, the providers' counts in their own columns
+    df = df_aggregate.copy()
+    df['provider'] = df['provider'].astype('str')
     
+    df_volume = df.groupby(['date', 'provider'])['pkg_counts'].sum().unstack(fill_value=0)
+    df_volume.columns = list(df_volume.columns)
+    df_volume.insert(loc=0, column='total_day_pkgs', value=df.groupby('date')['pkg_counts'].sum())
+    df_volume = df_volume.astype('int64')
     
+    return df_volume
+
+
+
+
+def first_dates(df):
+    # the package's first row of every date, rows without a package get nothing
+    first = ~df.duplicated(['package_key', 'date']).values
+    first = first & (df['package_key'].values >= 0)
     
+    return first
+
+
+
+
+def volume_columns(df, df_aggregate, first, provider_volume=False):
+    # build the daily volume table once
+    df_volume = daily_volume(df_aggregate)
+    columns = {}
     
-def add_aggregate(df_master, df_aggregate):
-    # get a copy of the master dataframe
-    df = df_master.copy()
-    
-    # create arrays for new columns
+    # join the day's total on the first rows, 0 for days without aggregate data
+    dates = df['date'].values[first]
     total_count_array = np.full(len(df), 0, dtype='int')
+    total_count_array[first] = df_volume['total_day_pkgs'].reindex(dates, fill_value=0).values
+    columns['total_day_pkgs'] = total_count_array
     
-    # insert blank column into dataframe
-    df.insert(loc=len(df.columns), column='total_day_pkgs', value=total_count_array)
+    # the day's package count of the package's provider
+    if provider_volume:
+        providers = df_volume.drop(columns='total_day_pkgs')
+        providers = providers.stack().rename('provider_day_pkgs')
+        
+        keys = pd.MultiIndex.from_arrays([dates, np.asarray(df['provider'].values[first], dtype='str')])
+        provider_count_array = np.full(len(df), 0, dtype='int')
+        provider_count_array[first] = providers.reindex(keys, fill_value=0).values
+        columns['provider_day_pkgs'] = provider_count_array
     
-    # get the unique package IDs from the dataframe
-    master_idx = pd.unique(df['package_id'])
+    return columns
+
+
+
+
+def add_aggregate(df_master, df_aggregate, provider_volume=False):
+    # get a copy of the master dataframe
+    df = df_master.copy()
     
-    # loop over all the packages and total number of day packages
-    for i in tqdm(master_idx):
-        # get the package's history
-        pkg = df[df['package_id'] == i]
-        
-        # get the unique dates
-        dates = pd.unique(pkg['date'])
-        
-        for d in dates:
-            # get the aggregate data for the date
-            df_agg = df_aggregate[df_aggregate['date'] == d]
-            
-            # get the total number of packages
-            total_pkgs = sum(df_agg['pkg_counts'])        
-            
-            # insert the new information into the dataframe
-            pkg_date_index = pkg[pkg['date'] == d].index        
-            df.at[pkg_date_index[0], 'total_day_pkgs'] = total_pkgs
+    # insert the daily package counts into dataframe
+    columns = volume_columns(df, df_aggregate, first_dates(df), provider_volume)
+    for name, values in columns.items():
+        df.insert(loc=len(df.columns), column=name, value=values)
             
     return df
+
+
+
+
+def day_numbers(dates):
+    # days since 1970-01-01 of yyyymmdd integer dates, -1 for invalid dates
+    days = pd.to_datetime(pd.Series(dates).astype('str'), format='%Y%m%d', errors='coerce')
+    numbers = days.values.astype('datetime64[D]').astype('int64')
     
-    
-    
+    return np.where(days.isna().values, -1, numbers)
+
+
+
+
+def weather_table(df_weather):
+    # the weather of every day from the first to the last weather date, the
+    # row of a day is its day number minus the first day number
+    days = day_numbers(df_weather['date'].values)
+    valid = days >= 0
+    
+    first_day, span = 0, 0
+    if valid.any():
+        first_day = days[valid].min()
+        span = days[valid].max() - first_day + 1
+    
+    table = {}
+    for name, default in WEATHER_DEFAULTS.items():
+        table[name] = np.full(span, default, dtype=np.asarray(default).dtype)
+    known = np.full(span, False)
+    
+    # the first row of a day is its weather, later duplicates are ignored
+    slots = days[valid] - first_day
+    rows = np.flatnonzero(valid)[::-1]
+    for name in WEATHER_DEFAULTS:
+        table[name][slots[::-1]] = df_weather[name].values[rows]
+    known[slots] = True
+    
+    return first_day, table, known
+
+
+
+
+def weather_columns(df, df_weather, first):
+    # load the weather into arrays by day number once
+    first_day, table, known = weather_table(df_weather)
+    
+    # the weather row of every first row, days without weather data get the defaults
+    slots = day_numbers(df['date'].values[first]) - first_day
+    found = (slots >= 0) & (slots < len(known))
+    found[found] = known[slots[found]]
+    rows = np.flatnonzero(first)
+    
+    missing = pd.unique(df['date'].values[first][~found])
+    if len(missing) > 0:
+        print("No weather data for", len(missing), "dates, using defaults.")
+    
+    # gather the weather on the first rows
+    columns = {}
+    for name, default in WEATHER_DEFAULTS.items():
+        array = np.full(len(df), default, dtype=np.asarray(default).dtype)
+        array[rows[found]] = table[name][slots[found]]
+        columns[name] = array
+    
+    return columns
+
+
+
 
 def add_weather(df_master, df_weather):
     # get a copy of the master dataframe
     df = df_master.copy()
     
-    # make arrays for the new columns
-    precip_array = np.full((len(df)), 0.0, dtype='float')
-    snow_array = np.full((len(df)), 0.0, dtype='float')
-    temp_array = np.full((len(df)), 0, dtype='int')
-    fog_array = np.full((len(df)), 0, dtype='int')
-    
-    # insert the new blank columns
-    df.insert(loc=len(df.columns), column='precip', value=precip_array)
-    df.insert(loc=len(df.columns), column='snow', value=snow_array)
-    df.insert(loc=len(df.columns), column='temp', value=temp_array)
-    df.insert(loc=len(df.columns), column='fog', value=fog_array)
-    
-    # get the unique package IDs
-    master_idx = pd.unique(df['package_id'])
-    
-    # loop over all the packages
-    for i in tqdm(master_idx):
-        # get the package's history
-        pkg = df[df['package_id'] == i]
-        
-        # get the unique dates
-        dates = pd.unique(pkg['date'])
-        
-        for d in dates:
-            # get the weather for date in a series
-            weather = df_weather[df_weather['date'] == d]
-            
-            # sequeeze df row into a series
-            weather.squeeze()
-            
-            # get indices for package's date
-            pkg_date_index = pkg[pkg['date'] == d].index
-            
-            # set the weather values
-            df.at[pkg_date_index[0], 'precip'] = weather['precip'].values[0]
-            df.at[pkg_date_index[0], 'snow'] = weather['snow'].values[0]
-            df.at[pkg_date_index[0], 'temp'] = weather['temp'].values[0]
-            df.at[pkg_date_index[0], 'fog'] = weather['fog'].values[0]
+    # insert the new columns
+    columns = weather_columns(df, df_weather, first_dates(df))
+    for name, values in columns.items():
+        df.insert(loc=len(df.columns), column=name, value=values)
             
     return df
+
+
+
+
+def build_master(df_history, df_aggregate, df_weather, index=None, provider_volume=False, fallbacks=None):
+    # index the packages' rows, unless an index of the dataframe was given
+    if index is None:
+        index = PackageIndex(df_history['package_key'].values)
+    
+    # the history columns as they are, no copy of the dataframe
+    columns = {name : df_history[name].values for name in df_history.columns}
+    
+    # the daily package counts and weather as plain arrays on the first rows
+    first = first_dates(df_history)
+    columns.update(volume_columns(df_history, df_aggregate, first, provider_volume))
+    columns.update(weather_columns(df_history, df_weather, first))
     
+    # compress every package into its feature row in one grouped pass
+    df = compress_columns(columns, index, fallbacks)
     
+    return df
+
+
+
+
+def partition_history(path, partitions):
+    # split the merged history into hash partitions of packages on disk, the
+    # partitions of an unchanged history are reused
+    history_path = path + 'merged_history/'
+    partition_path = path + 'partitions/'
+    manifest_path = partition_path + 'manifest.pkl'
+    paths = [partition_path + 'history_' + str(i) for i in range(partitions)]
+    
+    stamp = ('npy', partitions, os.path.getmtime(history_path + 'meta.pkl'))
+    if os.path.exists(manifest_path) and all(os.path.exists(p) for p in paths):
+        if pd.read_pickle(manifest_path) == stamp:
+            return paths
+    
+    # the partitions of an earlier run with more partitions are outdated
+    if os.path.exists(partition_path):
+        for name in os.listdir(partition_path):
+            number = name[len('history_'):]
+            if name.startswith('history_') and number.isdigit() and int(number) >= partitions:
+                shutil.rmtree(partition_path + name)
+    
+    # the history is streamed from its memory mapped columns a chunk at a time,
+    # it is never loaded as a whole
+    meta, columns = open_columns(history_path)
+    keys = columns['package_key']
+    chunks = range(0, len(keys), CHUNK_ROWS)
+    
+    # all the rows of a package go to the same partition, rows without a package
+    # (key -1) go to the first partition
+    sizes = np.zeros(partitions, dtype=np.int64)
+    for start in chunks:
+        parts = np.maximum(keys[start:start + CHUNK_ROWS], 0) % partitions
+        sizes += np.bincount(parts, minlength=partitions)
+    
+    # the history row of every row, the compressed packages keep the history order
+    meta = dict(meta, columns=meta['columns'] + ['row'])
+    dtypes = {name : values.dtype for name, values in columns.items()}
+    dtypes['row'] = np.dtype('int64')
+    targets = [allocate_columns(p, meta, size, dtypes) for p, size in zip(paths, sizes)]
+    
+    # append every chunk's rows to the end of their partitions, in history order
+    filled = np.zeros(partitions, dtype=np.int64)
+    for start in tqdm(chunks):
+        end = min(start + CHUNK_ROWS, len(keys))
+        parts = np.maximum(keys[start:end], 0) % partitions
+        order = np.argsort(parts, kind='stable')
+        counts = np.bincount(parts, minlength=partitions)
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        
+        chunk = {name : values[start:end][order] for name, values in columns.items()}
+        chunk['row'] = np.arange(start, end)[order]
+        for i in np.flatnonzero(counts):
+            for name, values in chunk.items():
+                targets[i][name][filled[i]:filled[i] + counts[i]] = values[offsets[i]:offsets[i + 1]]
+        filled += counts
     
+    for target in targets:
+        for values in target.values():
+            values.flush()
     
-def finalizer(df_master):
+    pd.to_pickle(stamp, manifest_path)
+    
+    return paths
+
+
+
+
+def partition_counts(task):
+    # the distinct daily package counts of a partition
+    partition_path, shared_path, provider_volume = task
+    df_history = read_columns(partition_path)
+    df_aggregate = read_columns(shared_path + 'aggregate')
+    
+    columns = volume_columns(df_history, df_aggregate, first_dates(df_history), provider_volume)
+    counts = {name : set(pd.unique(values).tolist()) for name, values in columns.items()}
+    
+    return counts
+
+
+
+
+def merge_partition(task):
+    # build a partition's part of the master dataframe
+    partition_path, shared_path, provider_volume, fallbacks = task
+    df_history = read_columns(partition_path)
+    if len(df_history) == 0:
+        return None
+    
+    df_aggregate = read_columns(shared_path + 'aggregate')
+    df_weather = read_columns(shared_path + 'weather')
+    df = build_master(df_history, df_aggregate, df_weather, provider_volume=provider_volume, \
+                      fallbacks=fallbacks)
+    
+    # the first history row of every package
+    first_row = df_history.groupby('package_key')['row'].min()
+    df.insert(loc=len(df.columns), column='row', value=df['package_key'].map(first_row).values)
+    
+    return df
+
+
+
+
+def map_partitions(func, tasks, workers):
+    # run the function on every partition, the results come back in partition
+    # order with any number of workers
+    if workers <= 1:
+        return [func(task) for task in tqdm(tasks)]
+    
+    # the workers only get the partitions' paths, they map the partitions themselves
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(tqdm(executor.map(func, tasks), total=len(tasks)))
+
+
+
+
+def build_master_partitioned(paths, df_aggregate, df_weather, provider_volume=False, workers=1):
+    # the aggregate and weather data are written once next to the partitions,
+    # the workers memory map them instead of unpickling a copy with every task
+    shared_path = os.path.dirname(paths[0]) + '/'
+    write_columns(df_aggregate, shared_path + 'aggregate')
+    write_columns(df_weather, shared_path + 'weather')
+    
+    # the volume fallbacks are averages over the whole history, collect the
+    # distinct daily package counts of every partition first
+    tasks = [(p, shared_path, provider_volume) for p in paths]
+    
+    counts = {}
+    for partition in map_partitions(partition_counts, tasks, workers):
+        for name, values in partition.items():
+            counts.setdefault(name, set()).update(values)
+    
+    fallbacks = {name : round(np.mean(list(values))) for name, values in counts.items()}
+    
+    # build every partition's part of the master dataframe
+    tasks = [(p, shared_path, provider_volume, fallbacks) for p in paths]
+    frames = [df for df in map_partitions(merge_partition, tasks, workers) if df is not None]
+    
+    # packages in order of first appearance in the whole history
+    df = pd.concat(frames)
+    df = df.sort_values('row', kind='stable').drop(columns='row')
+    df = df.reset_index(drop=True)
+    
+    return df
+
+
+
+
+def merge_state(df_aggregate, df_weather, fallbacks):
+    # what the master dataframe is built from beyond the package rows, the
+    # volume and weather of every day and the volume fallbacks
+    first_day, table, known = weather_table(df_weather)
+    df_days = pd.DataFrame(table)[known]
+    days = pd.to_datetime(first_day + np.flatnonzero(known), unit='D')
+    df_days.index = days.strftime('%Y%m%d').astype('int64')
+    
+    state = {'volume' : daily_volume(df_aggregate), 'weather' : df_days, 'fallbacks' : fallbacks}
+    
+    return state
+
+
+
+
+def changed_index(old, new):
+    # the index values whose row differs between two tables, values in only
+    # one of the tables changed as well, missing columns count as 0
+    old = pd.DataFrame(old)
+    new = pd.DataFrame(new)
+    
+    columns = old.columns.union(new.columns)
+    common = old.index.intersection(new.index)
+    old_values = old.reindex(index=common, columns=columns, fill_value=0).values
+    new_values = new.reindex(index=common, columns=columns, fill_value=0).values
+    
+    differ = (old_values != new_values) & ~(pd.isna(old_values) & pd.isna(new_values))
+    changed = common[differ.any(axis=1)]
+    
+    return old.index.symmetric_difference(new.index).append(changed)
+
+
+
+
+def stale_packages(state, current, df_history, df_keys, counts):
+    # the packages the touched record misses: packages with history on a day
+    # whose volume or weather changed, and the packages without daily counts
+    # when their fallback volume moved
+    keys = df_history['package_key'].values
+    stale = [keys[0:0]]
+    
+    dates = changed_index(state['volume'], current['volume'])
+    dates = dates.union(changed_index(state['weather'], current['weather']))
+    if len(dates) > 0:
+        stale.append(keys[np.isin(df_history['date'].values, dates.values.astype('int64'))])
+    
+    for name, values in counts.items():
+        if state['fallbacks'].get(name) != current['fallbacks'][name]:
+            stale.append(np.setdiff1d(pd.unique(keys), pd.unique(keys[values != 0])))
+    
+    stale = pd.unique(np.concatenate(stale))
+    package_ids = set(df_keys['package_id'].values[stale[stale >= 0]])
+    
+    return package_ids
+
+
+
+
+def refresh_master(df_stored, df_history, df_aggregate, df_weather, df_package, df_keys, \
+                   package_ids, fallbacks, provider_volume=False):
+    # the keys of the touched packages
+    touched = df_keys[df_keys['package_id'].isin(list(package_ids))]['package_key'].values
+    
+    # rebuild the touched packages' rows of the master dataframe, the volume
+    # fallbacks are averages over the whole history
+    df_touched = df_history[np.isin(df_history['package_key'].values, touched)]
+    df = build_master(df_touched, df_aggregate, df_weather, provider_volume=provider_volume, \
+                      fallbacks=fallbacks)
+    df = add_package(df, df_package[np.isin(df_package['package_key'].values, touched)], df_keys)
+    df = finalizer(df, df_keys)
+    
+    # upsert the rows by package ID
+    touched_ids = df_keys['package_id'].values[touched.astype('int64')]
+    df_stored = df_stored[~df_stored['package_id'].isin(touched_ids)]
+    df = pd.concat([df_stored, df])
+    
+    # packages in order of first appearance in the history, packages no longer
+    # in the history are dropped
+    keys = pd.unique(df_history['package_key'].values)
+    keys = keys[keys >= 0]
+    first = pd.Series(np.arange(len(keys)), index=df_keys['package_id'].values[keys])
+    position = df['package_id'].map(first).values
+    df = df[~np.isnan(position)]
+    df = df.iloc[np.argsort(position[~np.isnan(position)], kind='stable')]
+    df = df.reset_index(drop=True)
+    
+    return df
+
+
+
+
+def finalizer(df_master, df_keys):
     # get a copy of the master dataframe
     df = df_master.copy()
     
+    # translate the package keys back to the package IDs
+    package_ids = pd.Series(df_keys['package_id'].values, index=df_keys['package_key'].values)
+    df.insert(loc=0, column='package_id', value=df['package_key'].map(package_ids).values)
+    
     # remove packages with no zipcode
     zero_zipcode = df[df['zipcode'] == 0].index
     df = df.drop(zero_zipcode)
@@ -287,9 +654,12 @@ def finalizer(df_master):
     df = df.drop(zero_area)
     
     # reorder columns
-    df = df[['package_id', 'delivered', 'service', 'signature', 'zipcode', \
-             'provider', 'area', 'days', 'delays', 'failures','address', \
-             'resolution', 'volume', 'precip', 'temp']]
+    columns = ['package_id', 'delivered', 'service', 'signature', 'zipcode', \
+               'provider', 'area', 'days', 'delays', 'failures','address', \
+               'resolution', 'volume', 'precip', 'temp']
+    if 'provider_volume' in df.columns:
+        columns.insert(columns.index('volume')+1, 'provider_volume')
+    df = df[columns]
     
     # reset the index
     df = df.reset_index(drop=True)
@@ -299,7 +669,41 @@ def finalizer(df_master):
 
 
 
-def main():
+def main(args):
+    # check if only the packages touched since the last merge are refreshed
+    incremental = '--incremental' in args
+    args = [a for a in args if a != '--incremental']
+    
+    # check if a partition count is given, partitions bound the memory for
+    # histories too large to merge at once
+    partitions = 1
+    if len(args) > 1:
+        try:
+            partitions = int(args[1])
+            if partitions < 1:
+                raise ValueError
+        except ValueError:
+            print("Invalid partition count:", args[1])
+            print("Run script as follows:")
+            print("python merger.py [number of partitions] [number of workers] [--incremental]")
+            sys.exit()
+    
+    # check if a worker count is given, the workers merge the partitions in parallel
+    workers = 1
+    if len(args) > 2:
+        try:
+            workers = int(args[2])
+            if workers < 1:
+                raise ValueError
+        except ValueError:
+            print("Invalid worker count:", args[2])
+            print("Run script as follows:")
+            print("python merger.py [number of partitions] [number of workers] [--incremental]")
+            sys.exit()
+    
+    # every worker needs a partition
+    partitions = max(partitions, workers)
+    
     # check if path for weather data exists
     path = 'compiled/'
     if not os.path.exists(path):
@@ -315,13 +719,48 @@ def main():
     file_merged_history = 'df_merged_history.pkl'
     file_package = 'df_package.pkl'
     file_weather = 'df_weather.pkl'
+    file_keys = 'package_keys.pkl'
+    file_touched = 'touched_packages.pkl'
+    file_master = 'df_master.pkl'
+    file_state = 'master_state.pkl'
+    
+    # the packages touched since the last merge, recorded by preprocessor.py
+    touched = None
+    if os.path.exists(path + file_touched):
+        touched = pd.read_pickle(path + file_touched)
+    
+    # the state of the inputs is only kept for incremental refreshes, the state
+    # and the refresh need the whole history
+    keep_state = incremental
+    if keep_state:
+        partitions = 1
+    
+    # an incremental refresh needs the stored master dataframe, the state it was
+    # built from and the touched packages
+    if incremental:
+        stored = os.path.exists(path + file_master) and os.path.exists(path + file_state)
+        if touched is None or touched['packages'] is None or not stored:
+            print("No incremental refresh possible, the whole master dataframe is rebuilt.")
+            incremental = False
+    
+    # partitions are split from the columns of the merged history, older
+    # compiled directories only have its pickle
+    if partitions > 1 and not os.path.exists(path + 'merged_history/meta.pkl'):
+        print("No merged history columns found, the dataframes were compiled by an older version.")
+        print("Clean the dataframes again with preprocessor.py to merge in partitions.")
+        input("Press enter to continue...")
+        sys.exit()
     
     # load the data if it exists
     try:
         df_aggregate = pd.read_pickle(path + file_aggregate)
-        df_history = pd.read_pickle(path + file_merged_history)
+        if partitions == 1:
+            df_history = pd.read_pickle(path + file_merged_history)
+        else:
+            paths = partition_history(path, partitions)
         df_package = pd.read_pickle(path + file_package)
         df_weather = pd.read_pickle(path + file_weather)
+        df_keys = pd.read_pickle(path + file_keys)
         
     except:
         print("No data found.")
@@ -329,6 +768,20 @@ def main():
         input("Press enter to continue...")
         sys.exit()
     
+    # dates are yyyymmdd integers, older pickles stored them as strings
+    df_aggregate['date'] = df_aggregate['date'].astype('int32')
+    df_weather['date'] = df_weather['date'].astype('int32')
+    if partitions == 1:
+        df_history['date'] = df_history['date'].astype('int32')
+    
+    # the state the master dataframe is built from, the volume fallbacks are
+    # averages over the whole history
+    fallbacks = None
+    if keep_state:
+        counts = volume_columns(df_history, df_aggregate, first_dates(df_history), PROVIDER_VOLUME)
+        fallbacks = volume_fallbacks(counts)
+        state = merge_state(df_aggregate, df_weather, fallbacks)
+    
 
     #-----------------------MERGING BEGINS HERE------------------------>
     print("The master dataframe will begin to be built.")
@@ -337,44 +790,59 @@ def main():
     input("<Press enter to begin>")
     print("\n\n")
     
-    # initialize master dataframe
-    print("Adding package history data...")
-    df_master = df_history.copy()
-    print("Done.", end='\n\n')  
-    
-    # add aggregate data
-    print("Adding aggregate data...")
-    df_master = add_aggregate(df_master, df_aggregate)
-    print("Done.", end='\n\n')
-    
-    # add weather data
-    print("Adding weather data...")
-    df_master = add_weather(df_master, df_weather)
-    print("Done.", end='\n\n')
-    
-    # compress the master dataframe
-    print("Compressing master dataframe...")
-    df_master = compress(df_master)
-    print("Done.", end='\n\n')
-    
-    # ADD YO PACKAGE DATA HERE PLEASEE!!11!!1!1!!1!!!!
-    print("Adding package data...")
-    df_master = add_package(df_master, df_package)
-    print("Done.", end='\n\n')
-    
-    # finalize and last cleaning
-    print("Finalizing master dataframe...")
-    df_master = finalizer(df_master)
-    print("Done.", end='\n\n')
+    if incremental:
+        # rebuild only the touched packages and upsert them into the stored master dataframe
+        # the aggregate and weather data may be rebuilt and the fallbacks move
+        # with every new day, refresh their packages as well
+        package_ids = touched['packages'] | stale_packages(pd.read_pickle(path + file_state), state, \
+                                                           df_history, df_keys, counts)
+        print("Refreshing", len(package_ids), "touched packages in the master dataframe...")
+        df_stored = pd.read_pickle(path + file_master)
+        df_master = refresh_master(df_stored, df_history, df_aggregate, df_weather, df_package, \
+                                   df_keys, package_ids, fallbacks, provider_volume=PROVIDER_VOLUME)
+        print("Done.", end='\n\n')
+        
+    else:
+        # add the aggregate and weather data to the package history and compress
+        # it in one pass, without building the full master dataframe
+        print("Building master dataframe from package history, aggregate and weather data...")
+        if partitions == 1:
+            df_master = build_master(df_history, df_aggregate, df_weather, provider_volume=PROVIDER_VOLUME, \
+                                     fallbacks=fallbacks)
+        else:
+            print("Merging", partitions, "history partitions with", workers, "workers...")
+            df_master = build_master_partitioned(paths, df_aggregate, df_weather, \
+                                                 provider_volume=PROVIDER_VOLUME, workers=workers)
+        print("Done.", end='\n\n')
+        
+        # ADD YO PACKAGE DATA HERE PLEASEE!!11!!1!1!!1!!!!
+        print("Adding package data...")
+        df_master = add_package(df_master, df_package, df_keys)
+        print("Done.", end='\n\n')
+        
+        # finalize and last cleaning
+        print("Finalizing master dataframe...")
+        df_master = finalizer(df_master, df_keys)
+        print("Done.", end='\n\n')
     
     # check save path
     if not os.path.exists(path):
         os.makedirs(path)
       
     # save the master dataframe
-    df_master.to_pickle(path + 'df_master.pkl')
+    df_master.to_pickle(path + file_master)
     df_master.to_csv(path + 'package_data.csv', index=False)
     
+    # the state of a master dataframe built without it is outdated
+    if keep_state:
+        pd.to_pickle(state, path + file_state)
+    elif os.path.exists(path + file_state):
+        os.remove(path + file_state)
+    
+    # the master dataframe is up to date with every touched package
+    if touched is not None:
+        pd.to_pickle(dict(touched, packages=set()), path + file_touched)
+    
     # print success on completion
     print("MASTER DATAFRAME:")
     print(df_master, end='\n\n')
@@ -389,4 +857,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main(sys.argv)
\ No newline at end of file
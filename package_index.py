@@ -0,0 +1,85 @@
+"""
+package_index
+
+Description: Row index of a dataframe's packages. The rows are sorted by their
+package key once, then any package's rows are found by its offsets in the
+sorted rows instead of scanning the whole dataframe.
+"""
+
+import numpy as np
+
+
+class PackageIndex:
+    """
+    PackageIndex(keys) -> index (PackageIndex object)
+
+    args:
+    keys (int array) -> package key of every dataframe row, in row order
+
+    Desc:
+    Stable sort the rows by package key and keep the offsets of every package
+    in the sorted rows (CSR layout). A package's rows come back in row order.
+    Rows without a package (key -1) do not belong to any package. The index is only valid for the dataframe it
+    was built from, build a new one after rows are dropped or reordered.
+    """
+
+    def __init__(self, keys):
+        keys = np.asarray(keys)
+
+        # stable sort keeps every package's rows in row order
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+
+        # rows without a package sort first, leave them out
+        skip = np.searchsorted(sorted_keys, 0)
+        order = order[skip:]
+        sorted_keys = sorted_keys[skip:]
+
+        # the first sorted row of every package
+        starts = np.flatnonzero(np.diff(sorted_keys, prepend=-1) != 0)
+
+        self.order = order
+        self.keys = sorted_keys[starts]
+        self.offsets = np.append(starts, len(sorted_keys))
+        self.length = len(keys)
+
+
+    def __len__(self):
+        # number of packages
+        return len(self.keys)
+
+
+    def sizes(self):
+        """
+        sizes() -> sizes (int array)
+
+        args:
+        None
+
+        returns:
+        sizes (int array) -> number of rows of every package, in key order
+
+        Desc:
+        Get the row count of every package, aligned with the sorted keys.
+        """
+        sizes = np.diff(self.offsets)
+        return sizes
+
+
+    def ranks(self):
+        """
+        ranks() -> ranks (int32 array)
+
+        args:
+        None
+
+        returns:
+        ranks (int32 array) -> position of every row within its package, 0 without a package
+
+        Desc:
+        Number every package's rows in row order.
+        """
+        ranks = np.zeros(self.length, dtype='int32')
+        starts = np.repeat(self.offsets[:-1], self.sizes())
+        ranks[self.order] = np.arange(len(self.order)) - starts
+        return ranks
@@ -36,7 +36,7 @@ def main():
     data = data.fillna(0)
     
     # cast data types
-    data['DATE'] = data['DATE'].str.replace('-', '').astype('string')
+    data['DATE'] = data['DATE'].str.replace('-', '').astype('int32')
     data['PRCP'] = data['PRCP'].astype('float')
     data['SNOW'] = data['SNOW'].astype('float')
     data['TMAX'] = data['TMAX'].astype('int')
@@ -13,10 +13,13 @@ import pandas as pd
 # Python libraries
 import sys
 import os
+import re
+import bisect
 import datetime
 import pickle
+import hashlib
 import time
-from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
 # progress bar
 from tqdm import tqdm
@@ -25,6 +28,12 @@ from tqdm import tqdm
 from consolemenu import *
 from consolemenu.items import *
 
+# per-package row index
+from package_index import PackageIndex
+
+# dataframes stored as memory mapped columns
+from column_store import write_columns
+
 # warning handling
 import warnings
 
@@ -35,12 +44,45 @@ import warnings
 DATA_PATH = "data/"                 # Path to data
 OUTPUT_PATH = "compiled/"           # path for compiled data (dataframes)
 SCRIPT_PATH = "logs/"               # path for error logs and such
-FILES = []                          # File list
+FILES = []                          # File catalog [(date, filename)] sorted by date
 START = datetime.date(2000, 1, 1)   # Start date in date range
 END = datetime.date(2000, 1, 1)     # End date in date range
-DATAFRAMES = [[], [], [], [], []]   # dataframes [df_aggregate, df_package, df_history]
+WORKERS = 1                         # Worker processes for workbook extraction
+PARSER_VERSION = 5                  # Sidecar cache version, bump when sheet parsing changes
+DATAFRAMES = [[], [], [], [], [], []]   # dataframes [df_aggregate, df_package, df_history, df_pld, df_merged_history, df_package_keys]
 ERROR_LOGS = [[], [], []]           # Error logs [build_errors, merge_errors, clean_errors]
 
+# sheets read from every daily workbook, in build order, and the dataframe they build
+WORKBOOK_SHEETS = {'Daily' : 'df_aggregate (Daily)', \
+                   'SVC' : 'df_package (SVC)', \
+                   '85_SVC' : 'df_package (85_SVC)', \
+                   'HIST' : 'df_history (HIST)', \
+                   '85_HIST' : 'df_history (85_HIST)', \
+                   'PLD' : 'df_pld (PLD)', \
+                   '85' : 'df_pld (85)'}
+
+# compact column types of the history, PLD and merged history dataframes,
+# dates are int32 yyyymmdd and raw codes stay int16 (station code 300)
+HISTORY_SCHEMA = {'package_key' : 'int32', 'date' : 'int32', 'dow' : 'category', 'type' : 'category', \
+                  'station_code' : 'int16', 'driver_code' : 'int16', 'reason' : 'int16'}
+PLD_SCHEMA = {'package_key' : 'int32', 'zipcode' : 'int32', 'provider' : 'category', 'assigned_area' : 'int16', \
+              'loaded_area' : 'int16', 'station_code' : 'int16', 'driver_code' : 'int16', \
+              'date' : 'int32'}
+MERGED_SCHEMA = {'package_key' : 'int32', 'order' : 'int32', 'date' : 'int32', 'dow' : 'category', 'type' : 'category', \
+                 'station_code' : 'int16', 'driver_code' : 'int16', 'reason' : 'int16', \
+                 'zipcode' : 'int32', 'provider' : 'category', 'assigned_area' : 'int16', \
+                 'loaded_area' : 'int16'}
+
+# categories always present so cleaning can set them ('' is no PLD entry, 'None' is unknown)
+CATEGORIES = {'provider' : ['', 'A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'J', 'K', 'None']}
+
+# daily workbook names carry their date: PACKAGE_yyyymmdd
+# HIST code patterns: the code is the first token ('85\xa0\xa0Missing') without letters,
+# driver codes also carry a reason token ('02\xa0\xa073'), '---' marks an empty code
+FILE_DATE_REGEX = re.compile(r'PACKAGE_(\d{8})')
+STATION_CODE_REGEX = re.compile(r'^[A-Za-z]*(\d+)')
+DRIVER_CODE_REGEX = re.compile(r'^(?:[A-Za-z]*(\d+)[A-Za-z]*|---)?(?:(?:\xa0\xa0| )[A-Za-z]*(\d+))?')
+
 # ignore warnings
 warnings.filterwarnings('ignore')
 
@@ -99,11 +141,15 @@ def capture_filenames():
     
     # if the data path exists, try and get the filenames
     try:
+        file_list = []
         for file in os.listdir(data_path):
             name = os.path.join(data_path, file)
             
             if os.path.isfile(name):
-                append_filename(name)
+                file_list.append(name)
+        
+        # catalog the files by date
+        set_filenames(file_list)
     except:
         print("An error has occurred with getting the filenames.")
 
@@ -167,6 +213,18 @@ def load_dataframes():
         df = pd.read_pickle(path)
         set_dataframe(df, 'merged')
         
+    # get package key dictionary
+    path = os.path.join(output_path, 'package_keys.pkl')
+    if os.path.isfile(path):
+        df = pd.read_pickle(path)
+        set_dataframe(df, 'keys')
+    else:
+        # dataframes compiled before the package keys hold package IDs instead of keys
+        if success == True:
+            print("No package key dictionary found, the dataframes were compiled by an older version.")
+            print("Rebuild required: choose 'Rebuild All Dataframes' in the menu.")
+        success = False
+        
     # set empty if no success in getting dataframes
     if success == False:
         set_dataframe([], 'aggregate')
@@ -174,6 +232,7 @@ def load_dataframes():
         set_dataframe([], 'history')
         set_dataframe([], 'pld')
         set_dataframe([], 'merged')
+        set_dataframe([], 'keys')
         
     return success
     
@@ -237,11 +296,24 @@ def store_dataframes():
         except:
             success = False
         
+        # save package key dictionary
+        try:
+            path = os.path.join(output_path, 'package_keys.pkl')
+            df = get_dataframe('keys')
+            df.to_pickle(path)
+            success = True
+        except:
+            success = False
+        
         # save merged history
         try:
             path = os.path.join(output_path, 'df_merged_history.pkl')
             df = get_dataframe('merged')
             df.to_pickle(path)
+            
+            # the columns of the merged history, the merger splits them into
+            # partitions without loading the whole history
+            write_columns(df, os.path.join(output_path, 'merged_history'))
         except:
             print('')
         
@@ -283,6 +355,10 @@ def load_error_logs():
     if os.path.exists(path):
         with open(path, 'rb') as handle:
             log = pickle.load(handle)
+            
+            # older merge logs are lists of [package_id, date, error]
+            if isinstance(log, list):
+                log = pd.DataFrame(log, columns=['package_id', 'date', 'error'])
             set_error_log(log, 'merge')
             success = True
         
@@ -331,7 +407,412 @@ def store_error_logs():
         success = False
         
     return success
-# -------------------------------------------------------------------------------------------------------->
+
+
+
+
+def hash_file(file):
+    """
+    hash_file(file) -> file_hash (string)
+    
+    args:
+    file (string) -> filename
+    
+    returns:
+    file_hash (string) -> SHA-256 hex digest of the file contents
+    
+    Desc:
+    Hash the contents of a file in chunks.
+    """
+    sha = hashlib.sha256()
+    
+    # read the file in 1 MB chunks
+    with open(file, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(1 << 20), b''):
+            sha.update(chunk)
+            
+    file_hash = sha.hexdigest()
+    return file_hash
+
+
+
+
+def load_manifest():
+    """
+    load_manifest() -> manifest (dict)
+    
+    args:
+    None
+    
+    returns:
+    manifest (dict) -> {filename : {'size', 'mtime', 'hash'}} of ingested files
+    
+    Desc:
+    Load the ingestion manifest from the output directory. Empty if there is none.
+    """
+    # get the output path
+    output_path = get_path('output')
+    
+    # load the manifest if it exists
+    manifest = {}
+    path = os.path.join(output_path, 'manifest.pkl')
+    if os.path.isfile(path):
+        with open(path, 'rb') as handle:
+            manifest = pickle.load(handle)
+            
+    return manifest
+
+
+
+
+def store_manifest(manifest):
+    """
+    store_manifest(manifest) -> success (bool)
+    
+    args:
+    manifest (dict) -> {filename : {'size', 'mtime', 'hash'}} of ingested files
+    
+    returns:
+    success (bool) -> if operation was successful
+    
+    Desc:
+    Store the ingestion manifest in the output directory.
+    """
+    # get the output path
+    output_path = get_path('output')
+    
+    # if save is successful or not
+    success = False
+    
+    if os.path.exists(output_path):
+        path = os.path.join(output_path, 'manifest.pkl')
+        with open(path, 'wb') as handle:
+            pickle.dump(manifest, handle)
+        success = True
+        
+    return success
+
+
+
+
+def load_touched():
+    """
+    load_touched() -> touched (dict)
+    
+    args:
+    None
+    
+    returns:
+    touched (dict) -> {'files' : filenames, 'packages' : package IDs, 'tables' : imputation tables} since the last merge, None if there is none
+    
+    Desc:
+    Load the record of the packages touched since the last merger run. The
+    packages are None when the merger has to rebuild the whole master dataframe.
+    """
+    # get the output path
+    output_path = get_path('output')
+    
+    # load the record if it exists
+    touched = None
+    path = os.path.join(output_path, 'touched_packages.pkl')
+    if os.path.isfile(path):
+        with open(path, 'rb') as handle:
+            touched = pickle.load(handle)
+            
+    return touched
+
+
+
+
+def store_touched(touched):
+    """
+    store_touched(touched) -> success (bool)
+    
+    args:
+    touched (dict) -> {'files' : filenames, 'packages' : package IDs, 'tables' : imputation tables} since the last merge
+    
+    returns:
+    success (bool) -> if operation was successful
+    
+    Desc:
+    Store the record of the packages touched since the last merger run in the
+    output directory, the merger reads it for an incremental refresh.
+    """
+    # get the output path
+    output_path = get_path('output')
+    
+    # if save is successful or not
+    success = False
+    
+    if os.path.exists(output_path):
+        path = os.path.join(output_path, 'touched_packages.pkl')
+        with open(path, 'wb') as handle:
+            pickle.dump(touched, handle)
+        success = True
+        
+    return success
+
+
+
+
+def update_touched(touched, files, changed, file_results):
+    """
+    update_touched(touched, files, changed, file_results) -> touched (dict)
+    
+    args:
+    touched (dict) -> record of the last build, None if there is none
+    files (string list) -> workbook filenames of this build
+    changed (string list) -> files that were added or changed since the last build
+    file_results (dict) -> {filename : (frames, errors, inventory)} of this build
+    
+    returns:
+    touched (dict) -> {'files' : filenames, 'packages' : package IDs, 'tables' : imputation tables} since the last merge
+    
+    Desc:
+    Add the package IDs of the added and changed files to the packages touched
+    since the last merge. Without a record, or when files left the build, any
+    package may have changed and the packages are None (rebuild everything).
+    """
+    names = [os.path.basename(f) for f in files]
+    
+    packages = None
+    if touched is not None and touched['packages'] is not None:
+        if set(touched['files']) <= set(names):
+            packages = set(touched['packages'])
+    
+    # every package ID in the changed files' sheets
+    if packages is not None:
+        for file in changed:
+            frames = file_results[file][0]
+            for sheet in ['SVC', '85_SVC', 'HIST', '85_HIST', 'PLD', '85']:
+                if sheet in frames:
+                    packages.update(frames[sheet]['package_id'].dropna().tolist())
+    
+    # the imputation tables of the last clean are kept
+    tables = touched.get('tables') if touched is not None else None
+    
+    touched = {'files' : names, 'packages' : packages, 'tables' : tables}
+    return touched
+
+
+
+
+def update_imputed(touched, tables, df_history, df_keys):
+    """
+    update_imputed(touched, tables, df_history, df_keys) -> touched (dict)
+    
+    args:
+    touched (dict) -> record of the packages touched since the last merge
+    tables (dict) -> imputation tables fix_zipcode_provider built in this clean
+    df_history (dataframe) -> merged history the tables were built from, before cleaning
+    df_keys (dataframe) -> package key dictionary of the history
+    
+    returns:
+    touched (dict) -> {'files' : filenames, 'packages' : package IDs, 'tables' : imputation tables}
+    
+    Desc:
+    fix_zipcode_provider fills in zipcodes, providers and areas from tables
+    built over the whole history, so new days change the imputed values of
+    packages no changed file holds. Add the packages with a zipcode, area or
+    provider whose table entry changed since the last clean. Without the
+    tables of the last clean the packages are None (rebuild everything).
+    """
+    packages = touched['packages']
+    if touched.get('tables') is None:
+        packages = None
+    
+    if packages is not None:
+        # the looked up values whose entry was added, removed or changed
+        changed = {}
+        for name, table in tables.items():
+            old = touched['tables'][name]
+            changed[name] = [k for k in set(old) | set(table) if old.get(k) != table.get(k)]
+        
+        # every package with a row looking up a changed entry
+        areas = changed['area_zip'] + changed['area_provider']
+        rows = np.isin(df_history['assigned_area'].values, areas) | \
+               np.isin(df_history['loaded_area'].values, areas) | \
+               np.isin(df_history['zipcode'].values, changed['zip_area']) | \
+               df_history['provider'].isin(changed['provider_zip']).values
+        keys = pd.unique(df_history['package_key'].values[rows])
+        packages = set(packages) | set(df_keys['package_id'].values[keys[keys >= 0]])
+    
+    touched = {'files' : touched['files'], 'packages' : packages, 'tables' : tables}
+    return touched
+
+
+
+
+def scan_manifest(files, manifest):
+    """
+    scan_manifest(files, manifest) -> entries (dict), changed (string list)
+    
+    args:
+    files (string list) -> workbook filenames
+    manifest (dict) -> manifest of the last build
+    
+    returns:
+    entries (dict) -> manifest entries for the current files
+    changed (string list) -> files that were added or changed since the last build
+    
+    Desc:
+    Compare the files against the manifest. A file whose size and mtime match
+    its entry is unchanged; otherwise its contents are hashed to decide.
+    """
+    entries = {}
+    changed = []
+    
+    for file in files:
+        name = os.path.basename(file)
+        stat = os.stat(file)
+        entry = {'size' : stat.st_size, 'mtime' : stat.st_mtime, 'hash' : ''}
+        old_entry = manifest.get(name)
+        
+        # same size and mtime, trust the recorded hash
+        if old_entry and old_entry['size'] == entry['size'] and old_entry['mtime'] == entry['mtime']:
+            entry['hash'] = old_entry['hash']
+        else:
+            entry['hash'] = hash_file(file)
+        
+        # added or changed files need to be parsed again
+        if not old_entry or old_entry['hash'] != entry['hash']:
+            changed.append(file)
+            
+        entries[name] = entry
+        
+    return entries, changed
+
+
+
+
+def sidecar_prefix(file_hash):
+    """
+    sidecar_prefix(file_hash) -> prefix (string)
+    
+    args:
+    file_hash (string) -> SHA-256 hex digest of a workbook
+    
+    returns:
+    prefix (string) -> path prefix of the workbook's sidecar files
+    
+    Desc:
+    Sidecars are keyed by the workbook contents and the parser version.
+    """
+    # get the output path
+    output_path = get_path('output')
+    
+    prefix = os.path.join(output_path, 'cache', file_hash + '_v' + str(PARSER_VERSION) + '_')
+    return prefix
+
+
+
+
+def load_sidecars(file_hash):
+    """
+    load_sidecars(file_hash) -> frames (dict), errors (dict), inventory (dict)
+    
+    args:
+    file_hash (string) -> SHA-256 hex digest of a workbook
+    
+    returns:
+    frames (dict) -> built dataframes keyed by sheet name, None if not cached
+    errors (dict) -> build error entries keyed by sheet name, None if not cached
+    inventory (dict) -> {sheet name : data row count}, None if not cached or the workbook did not open
+    
+    Desc:
+    Load a workbook's built dataframes from its sidecar files.
+    """
+    prefix = sidecar_prefix(file_hash)
+    
+    # the error log is written last, without it the sidecars are incomplete
+    path = prefix + 'meta.pkl'
+    if not os.path.isfile(path):
+        return None, None, None
+        
+    with open(path, 'rb') as handle:
+        errors, inventory = pickle.load(handle)
+    
+    # read the columnar sidecars, or the pickled ones feather could not store
+    frames = {}
+    for sheet in WORKBOOK_SHEETS:
+        if os.path.isfile(prefix + sheet + '.feather'):
+            frames[sheet] = pd.read_feather(prefix + sheet + '.feather')
+        elif os.path.isfile(prefix + sheet + '.pkl'):
+            frames[sheet] = pd.read_pickle(prefix + sheet + '.pkl')
+            
+    return frames, errors, inventory
+
+
+
+
+def store_sidecars(file_hash, frames, errors, inventory):
+    """
+    store_sidecars(file_hash, frames, errors, inventory) -> None
+    
+    args:
+    file_hash (string) -> SHA-256 hex digest of a workbook
+    frames (dict) -> built dataframes keyed by sheet name
+    errors (dict) -> build error entries keyed by sheet name
+    inventory (dict) -> {sheet name : data row count}, None if the workbook did not open
+    
+    returns:
+    None
+    
+    Desc:
+    Store a workbook's built dataframes as feather sidecar files. Dataframes
+    feather cannot store (no pyarrow, mixed object columns) are pickled instead.
+    """
+    prefix = sidecar_prefix(file_hash)
+    
+    # create the cache directory if needed
+    path = os.path.dirname(prefix)
+    if not os.path.exists(path):
+        os.makedirs(path)
+    
+    for sheet, df in frames.items():
+        # the row index is not kept, build_data resets it anyway
+        df = df.reset_index(drop=True)
+        try:
+            df.to_feather(prefix + sheet + '.feather')
+        except Exception:
+            if os.path.isfile(prefix + sheet + '.feather'):
+                os.remove(prefix + sheet + '.feather')
+            df.to_pickle(prefix + sheet + '.pkl')
+    
+    # write the error log and inventory last to mark the sidecars complete
+    with open(prefix + 'meta.pkl', 'wb') as handle:
+        pickle.dump((errors, inventory), handle)
+
+
+
+
+def purge_sidecars(hashes):
+    """
+    purge_sidecars(hashes) -> None
+    
+    args:
+    hashes (string list) -> hashes of the ingested workbooks
+    
+    returns:
+    None
+    
+    Desc:
+    Remove sidecar files of workbooks no longer ingested and sidecar files
+    written by another parser version.
+    """
+    # get the output path
+    output_path = get_path('output')
+    
+    path = os.path.join(output_path, 'cache')
+    if not os.path.exists(path):
+        return
+    
+    version = 'v' + str(PARSER_VERSION)
+    for name in os.listdir(path):
+        # sidecar names are <hash>_v<version>_<sheet>
+        parts = name.split('_', 2)
+        if len(parts) < 3 or parts[0] not in hashes or parts[1] != version:
+            os.remove(os.path.join(path, name))
 # ---------------------------------------------- END FILE FUNCTIONS -------------------------------------->
 # -------------------------------------------------------------------------------------------------------->
 
@@ -359,17 +840,21 @@ def menu(start_string, end_string):
     
     # menu options
     option_build  = FunctionItem("Build Dataframes", build_data, [])
+    option_rebuild = FunctionItem("Rebuild All Dataframes", build_data, [True])
     option_merge  = FunctionItem("Merge Dataframes", history_merge_pld, [])
     option_clean  = FunctionItem("Clean Dataframes", clean_data, [])
     option_dates  = FunctionItem("Display All File Dates", display_dates, [])
+    option_range  = FunctionItem("Set Date Range", select_date_range, [])
     option_errors = FunctionItem("Show Errors", display_errors, [])
     option_show   = FunctionItem("Show Built Dataframes", display_dataframes, [])
     
     # add options to the menu
     main_menu.append_item(option_build)
+    main_menu.append_item(option_rebuild)
     main_menu.append_item(option_merge)
     main_menu.append_item(option_clean)
     main_menu.append_item(option_dates)
+    main_menu.append_item(option_range)
     main_menu.append_item(option_errors)
     main_menu.append_item(option_show)
     
@@ -384,14 +869,31 @@ def menu(start_string, end_string):
 # -------------------------------------------------------------------------------------------------------->
 # -------------------------------------------------- HELPER FUNCTIONS ------------------------------------>
 # -------------------------------------------------------------------------------------------------------->
+def parse_file_date(filename):
+    # get the PACKAGE_yyyymmdd date from the file's basename, None if there is none
+    match = FILE_DATE_REGEX.search(os.path.basename(filename))
+    
+    date = None
+    if match:
+        try:
+            date = str_to_date(match.group(1))
+        except ValueError:
+            date = None
+    
+    return date
+    
+    
+    
+    
 def capture_file_date(filename):
     # set default date
     date = datetime.date(2000, 1, 1)
     
     # try to obtain the date from the filename
-    try:
-        date = str_to_date(filename[13:21])
-    except:
+    file_date = parse_file_date(filename)
+    if file_date is not None:
+        date = file_date
+    else:
         print("\n")
         print("An error with getting the date for " + filename + " has occurred.")
         print("Proper filename format needed: PACKAGE_yyyymmdd")
@@ -414,6 +916,14 @@ def date_to_str(date):
     # convert date into a string
     str_date = date.strftime('%Y%m%d')
     return str_date
+    
+    
+    
+    
+def date_to_int(date):
+    # convert date into a yyyymmdd integer
+    int_date = int(date_to_str(date))
+    return int_date
 # -------------------------------------------------------------------------------------------------------->
 # ---------------------------------------------- END HELPER FUNCTIONS ------------------------------------>
 # -------------------------------------------------------------------------------------------------------->
@@ -461,13 +971,13 @@ def display_errors():
         elif option.upper() == 'M':
             if len(merge_log) != 0:
                 error_index = 1
-                # print error report for data merging
-                for i in merge_log:
+                # print error report for data merging, PLD rows without a history entry
+                for i in merge_log.itertuples():
                     print('\n')
                     print("Error #", error_index)
-                    print('Error with package:', i[0])
-                    print('Merging PLD date:', i[1])
-                    print(type(i[2]), ':', i[2])
+                    print('Error with package:', i.package_id)
+                    print('Merging PLD date:', i.date)
+                    print('No history entry for the PLD date')
                     print('\n')
                     
                     error_index += 1
@@ -515,16 +1025,52 @@ def display_dataframes():
     
     
 def display_dates():
-    # get file list
-    filenames = get_filenames()
+    # get the file catalog
+    catalog = get_catalog()
     
-    # capture date and display
-    for f in filenames:
-        date = capture_file_date(f)
+    # display the file dates
+    for date, f in catalog:
         print(date)
       
     print("\n\n")
     input("Press enter to continue...")
+    
+    
+    
+    
+def select_date_range():
+    # get the file catalog
+    catalog = get_catalog()
+    
+    # show the dates that can be built
+    print("Files are available from", catalog[0][0], "to", catalog[len(catalog)-1][0])
+    print("Current date range:", get_start_date(), "to", get_end_date(), end='\n\n')
+    
+    # ask for the new date range
+    start_string = input("Start date (yyyymmdd): ")
+    end_string = input("End date (yyyymmdd): ")
+    
+    try:
+        start_date = str_to_date(start_string)
+        end_date = str_to_date(end_string)
+    except ValueError:
+        start_date = None
+        end_date = None
+        
+    if start_date is None or end_date is None or start_date > end_date:
+        print('\n')
+        print("Invalid date range.", end='\n\n')
+    else:
+        # builds and cleaning use the new range
+        set_start_date(start_date)
+        set_end_date(end_date)
+        
+        files = get_filenames_in_range(start_date, end_date)
+        print('\n')
+        print("Date range set:", start_date, "to", end_date)
+        print("Files in range:", len(files), end='\n\n')
+    
+    input("Press enter to continue...")
 # -------------------------------------------------------------------------------------------------------->
 # -------------------------------------------- END DISPLAY FUNCTIONS ------------------------------------->
 # -------------------------------------------------------------------------------------------------------->
@@ -611,12 +1157,23 @@ def set_filenames(file_list):
     None
     
     Desc:
-    Set the global list of filenames.
+    Set the global file catalog. Files are sorted by their PACKAGE_yyyymmdd
+    date, files without a date in their name are left out.
     """
     global FILES
     
-    # set the global file list
-    FILES = file_list
+    # catalog the files by date
+    catalog = []
+    for f in file_list:
+        date = parse_file_date(f)
+        
+        if date is None:
+            print("Skipping " + f + ", proper filename format needed: PACKAGE_yyyymmdd")
+        else:
+            catalog.append((date, f))
+    
+    # set the global file catalog
+    FILES = sorted(catalog)
 
 
 
@@ -632,12 +1189,16 @@ def append_filename(filename):
     None
     
     Desc:
-    Append filename to the global list of filenames.
+    Add a filename to the global file catalog, in date order.
     """
     global FILES
     
-    # append the file name to global file list
-    FILES.append(filename)
+    # insert the file by its date
+    date = parse_file_date(filename)
+    if date is None:
+        print("Skipping " + filename + ", proper filename format needed: PACKAGE_yyyymmdd")
+    else:
+        bisect.insort(FILES, (date, filename))
     
     
     
@@ -653,17 +1214,66 @@ def get_filenames():
     file_list (string) -> list of filenames
     
     Desc:
-    Get the list of filenames from the global filename list.
+    Get the list of filenames from the global file catalog, in date order.
     """
     global FILES
     
     # return the global filename list
-    file_list = tuple(FILES)
+    file_list = tuple(f for date, f in FILES)
+    return file_list
+    
+    
+    
+    
+def get_filenames_in_range(start_date, end_date):
+    """
+    get_filenames_in_range(start_date, end_date) -> file_list (string tuple)
+    
+    args:
+    start_date (datetime object) -> first file date
+    end_date (datetime object) -> last file date
+    
+    returns:
+    file_list (string tuple) -> filenames dated within the range, in date order
+    
+    Desc:
+    Get the filenames in a date range from the global file catalog.
+    """
+    global FILES
+    
+    # the catalog is sorted, find the range by bisection
+    dates = [date for date, f in FILES]
+    lo = bisect.bisect_left(dates, start_date)
+    hi = bisect.bisect_right(dates, end_date)
+    
+    file_list = tuple(f for date, f in FILES[lo:hi])
     return file_list
     
     
     
     
+def get_catalog():
+    """
+    get_catalog() -> catalog (tuple)
+    
+    args:
+    None
+    
+    returns:
+    catalog (tuple) -> (date, filename) pairs sorted by date
+    
+    Desc:
+    Get the global file catalog.
+    """
+    global FILES
+    
+    # return the global file catalog
+    catalog = tuple(FILES)
+    return catalog
+    
+    
+    
+    
 def set_start_date(date):
     """
     set_start_date(date) -> None
@@ -755,6 +1365,49 @@ def get_end_date():
     end_date = END
     return end_date
 
+
+
+
+def set_workers(workers):
+    """
+    set_workers(workers) -> None
+    
+    args:
+    workers (int) -> number of worker processes
+    
+    returns:
+    None
+    
+    Desc:
+    Set the global number of worker processes used to extract workbooks.
+    """
+    global WORKERS
+    
+    # never go below one worker
+    WORKERS = max(int(workers), 1)
+    
+    
+    
+    
+def get_workers():
+    """
+    get_workers() -> workers (int)
+    
+    args:
+    None
+    
+    returns:
+    workers (int) -> number of worker processes
+    
+    Desc:
+    Get the global number of worker processes used to extract workbooks.
+    """
+    global WORKERS
+    
+    # return the global worker count
+    workers = WORKERS
+    return workers
+
     
     
     
@@ -784,6 +1437,8 @@ def set_dataframe(df, df_type):
         DATAFRAMES[3] = df
     elif df_type == 'merged':
         DATAFRAMES[4] = df
+    elif df_type == 'keys':
+        DATAFRAMES[5] = df
     else:
         print("", end="")
     
@@ -816,6 +1471,8 @@ def get_dataframe(df_type):
         df = DATAFRAMES[3].copy()
     elif df_type == 'merged':
         df = DATAFRAMES[4].copy()
+    elif df_type == 'keys':
+        df = DATAFRAMES[5].copy()
     else:
         df = None
         
@@ -891,9 +1548,9 @@ def get_error_log(log_type):
 # -------------------------------------------------- DATAFRAME FUNCTIONS --------------------------------->
 # -------------------------------------------------------------------------------------------------------->
 
-def make_aggregate_dataframe(xlsx_file, date):
-    # read Excel sheet
-    df = pd.read_excel(xlsx_file, 'Daily')
+def make_aggregate_dataframe(df_sheet, date):
+    # copy the parsed 'Daily' sheet
+    df = df_sheet.copy()
     
     # drop total row from dataframe
     df = df.drop(len(df)-1)
@@ -911,7 +1568,7 @@ def make_aggregate_dataframe(xlsx_file, date):
     df = df.sort_values('Provider')
     
     # create an array for the date representing the column to be added to the dataframe
-    array_date = np.full((len(df)), date_to_str(date))
+    array_date = np.full((len(df)), date_to_int(date), dtype='int32')
     
     # insert the date column column
     df.insert(loc=0, column='Date', value=array_date)
@@ -928,7 +1585,7 @@ def make_aggregate_dataframe(xlsx_file, date):
     df = df[['date', 'provider', 'area_counts', 'pkg_counts', 'pkg_returns', 'pkg_missing']]
     
     # cast types
-    df['date'] = df['date'].astype('string')
+    df['date'] = df['date'].astype('int32')
     df['provider'] = df['provider'].astype('string')
     df['area_counts'] = df['area_counts'].astype('int')
     df['pkg_counts'] = df['pkg_counts'].astype('int')
@@ -942,9 +1599,9 @@ def make_aggregate_dataframe(xlsx_file, date):
 
 
 
-def make_package_dataframe(xlsx_file, sheet_name):
-    # read Excel sheets
-    df = pd.read_excel(xlsx_file, sheet_name)
+def make_package_dataframe(df_sheet):
+    # copy the parsed 'SVC' or '85_SVC' sheet
+    df = df_sheet.copy()
     
     # fill any missing 'Service' values as 'S' (Standard service)
     df['Service'] = df['Service'].fillna('S')
@@ -963,9 +1620,9 @@ def make_package_dataframe(xlsx_file, sheet_name):
     
     
     
-def make_history_dataframe(xlsx_file, sheet_name):
-    # read Excel sheets
-    df = pd.read_excel(xlsx_file, sheet_name)
+def make_history_dataframe(df_sheet):
+    # copy the parsed 'HIST' or '85_HIST' sheet
+    df = df_sheet.copy()
 
     # drop the time stamp
     df = df.drop('Time', axis=1)
@@ -975,35 +1632,8 @@ def make_history_dataframe(xlsx_file, sheet_name):
     date_split = df['Date'].str.split('\xa0',n=1, expand=True)
     date_split = date_split.rename(columns={0 : 'Date', 1 : 'DoW'})
     
-    # loop over all the dates and convert them
-    default_date = '99999999'
-    for i in range(len(date_split['Date'])):
-        # try to reformat the date
-        try:
-            old_date = date_split['Date'].iloc[i].split('/')
-            
-            # concat year
-            if old_date[2] == '99':
-                new_date = default_date
-            else:
-                new_date = '20' + old_date[2]
-                
-                # concat month
-                if len(old_date[0]) < 2:
-                    new_date = new_date + '0' + old_date[0]
-                else:
-                    new_date = new_date + old_date[0]
-                
-                # concat day
-                if len(old_date[1]) < 2:
-                    new_date = new_date + '0' + old_date[1]
-                else:
-                    new_date = new_date + old_date[1]
-        except:
-            # if error reformating date, set to default
-            new_date = default_date
-            
-        date_split['Date'].iloc[i] = new_date
+    # convert all the dates to yyyymmdd
+    date_split['Date'] = convert_history_dates(date_split['Date'])
     
     # drop the original date column
     df = df.drop('Date', axis=1)
@@ -1012,89 +1642,107 @@ def make_history_dataframe(xlsx_file, sheet_name):
     df = df.merge(date_split, how='left', left_index=True, right_index=True)
     # ------------------------- END CONVERT DATES -------------------------->  
     
-    # ------------------------- SPLIT STATION CODES ------------------------>          
-    # replace weird escape sequence and split codes and subcodes
-    station_split = df['Station Code'].str.replace('\xa0\xa0', ' ')
-    station_split = station_split.str.split(' ', n=1, expand=True)
+    # ------------------------- PARSE STATION/DRIVER CODES ----------------->
+    # station codes keep the code, driver codes keep the code and the reason
+    # driver codes without a reason token get reason 0, a sheet without any
+    # reason tokens (often 85_HIST) is built instead of failing on 'Reason'
+    station_split = parse_history_codes(df['Station Code'], STATION_CODE_REGEX)
+    driver_split = parse_history_codes(df['Driver Code'], DRIVER_CODE_REGEX)
     
-    # drop un-needed Station Subcodes
-    station_split = station_split.drop(1, axis=1)
+    # replace the original code columns with the parsed codes
+    df['Station Code'] = station_split[0]
+    df['Driver Code'] = driver_split[0]
+    df['Reason'] = driver_split[1]
+    # ------------------------- CODES COMPLETE ----------------------------->
     
     # rename columns
-    station_split = station_split.rename(columns={0 : 'Station Code'})
+    df = df.rename(columns={'Package ID' : 'package_id', 'Date' : 'date', 'DoW' : 'dow', \
+                           'Type' : 'type',  'Station Code' : 'station_code', \
+                           'Driver Code' : 'driver_code', 'Reason' : 'reason'})
     
-    # replace empty code markers with zero
-    station_split.loc[station_split['Station Code'] == '---', 'Station Code'] = '0'
+    # reorder and retain appropriate columns
+    column_order = ['package_id', 'date', 'dow', 'type', 'station_code', 'driver_code', 'reason']
+    df = df[column_order]
     
-    # fill in missing/NaN values and cast as integer type
-    for i in station_split.columns:
-        station_split[i] = station_split[i].str.replace('[a-zA-Z]', '', regex=True)
-        station_split[i] = station_split[i] = station_split[i].fillna(0)
-        station_split[i] = station_split[i].astype('int')
+    # cast column types
+    df['package_id'] = df['package_id'].astype('string')
+    df = apply_schema(df, HISTORY_SCHEMA)
+
+    # recodedDF = recode_history(df)
+    # compress_history(recodedDF)
+    return df
+
+
+
+
+def parse_history_codes(codes, regex):
+    # a sheet only holds a few distinct codes, parse each one once
+    labels, uniques = pd.factorize(codes)
+    uniques = pd.Series(uniques, dtype='object')
     
-    # drop the original Station Codes column
-    df = df.drop(('Station Code'), axis=1)
+    # one regex extract per column, codes that do not match are 0
+    parts = uniques.str.extract(regex)
+    parts = parts.fillna('0').astype('int16')
     
-    # merge the codes back into the original dataframe
-    df = df.merge(station_split, how='left', left_index=True, right_index=True)
-    # ------------------------- STATION CODES COMPLETE --------------------->
+    # map the parsed codes back onto every row, missing codes are 0
+    df = pd.DataFrame(index=codes.index)
+    for i in parts.columns:
+        df[i] = np.append(parts[i].values, np.int16(0))[labels]
+        
+    return df
+
+
+
+
+def convert_history_dates(dates):
+    # default for malformed dates and the '99' year
+    default_date = '99999999'
     
+    # a sheet only holds a few hundred distinct dates, convert each one once
+    codes, uniques = pd.factorize(dates)
+    uniques = pd.Series(uniques, dtype='object')
     
-    # ------------------------- SPLIT DRIVER CODES ------------------------->  
-    # replace weird escape sequence and split codes and subcodes
-    driver_split = df['Driver Code'].str.replace('\xa0\xa0', ' ')
-    driver_split = driver_split.str.split(' ', n=1, expand=True)
+    # split M/D/YY into its parts, missing parts are NaN
+    parts = uniques.str.split('/')
+    month = parts.str[0]
+    day = parts.str[1]
+    year = parts.str[2]
     
-    # rename columns
-    driver_split = driver_split.rename(columns={0 : 'Driver Code', 1 : 'Reason'})
+    # zero pad single digit months and days
+    month = month.where(month.str.len() >= 2, '0' + month)
+    day = day.where(day.str.len() >= 2, '0' + day)
     
-    # replace empty code markers with zero
-    driver_split.loc[driver_split['Driver Code'] == '---', 'Driver Code'] = '0'
-    driver_split.loc[driver_split['Reason'] == '---', 'Reason'] = '0'
+    # concat year, month and day
+    new_dates = '20' + year + month + day
     
+    # the '99' year and dates with missing parts get the default
+    new_dates = new_dates.where(year != '99', default_date)
+    new_dates = new_dates.fillna(default_date)
     
-    # fill in missing/NaN values and cast as integer type
-    for i in driver_split.columns:
-        driver_split[i] = driver_split[i].str.replace('[a-zA-Z]', '', regex=True)
-        driver_split[i] = driver_split[i] = driver_split[i].fillna(0)
-        driver_split[i] = driver_split[i].astype('int')
-     
-    # drop the original Station Codes column
-    df = df.drop(('Driver Code'), axis=1)
-     
-    # merge the codes back into the original dataframe
-    df = df.merge(driver_split, how='left', left_index=True, right_index=True)
-    # ------------------------- DRIVER CODES COMPLETE ---------------------->
+    # anything but eight digits is malformed, like '1/1/ab', '1/2/23 ' or '12/31/2023'
+    new_dates = new_dates.where(new_dates.str.fullmatch(r'\d{8}'), default_date)
     
-    # rename columns
-    df = df.rename(columns={'Package ID' : 'package_id', 'Date' : 'date', 'DoW' : 'dow', \
-                           'Type' : 'type',  'Station Code' : 'station_code', \
-                           'Driver Code' : 'driver_code', 'Reason' : 'reason'})
+    # yyyymmdd integers, only the unique dates are cast
+    new_dates = new_dates.astype('int32')
     
-    # reorder and retain appropriate columns
-    column_order = ['package_id', 'date', 'dow', 'type', 'station_code', 'driver_code', 'reason']
-    df = df[column_order]
+    # map the converted dates back onto every row, missing dates get the default
+    new_dates = np.append(new_dates.values, np.int32(default_date))[codes]
+    new_dates = pd.Series(new_dates, index=dates.index, dtype='int32')
     
-    # cast column types
-    for i in df[['package_id', 'date', 'dow', 'type']].columns:
-        df[i] = df[i].astype('string')
-
-    # recodedDF = recode_history(df)
-    # compress_history(recodedDF)
-    return df
+    return new_dates
 
 
 
 
-def make_pld_dataframe(xlsx_file,  sheet_name, date):
-    # read Excel sheet
-    df = pd.read_excel(xlsx_file, sheet_name)
+def make_pld_dataframe(df_sheet, date):
+    # copy the parsed 'PLD' or '85' sheet
+    df = df_sheet.copy()
     
     # drop Count and Time columns
     df = df.drop(['Count', 'Time'], axis=1)
     
     # create an array for the date representing the column to be added to the dataframe
-    array_date = np.full((len(df)), date_to_str(date))
+    array_date = np.full((len(df)), date_to_int(date), dtype='int32')
     
     # insert the date column column
     df.insert(loc=0, column='Date', value=array_date)
@@ -1117,20 +1765,14 @@ def make_pld_dataframe(xlsx_file,  sheet_name, date):
     # ---------------- FILL AND CAST VALUE TYPES ----------------------->
     df['package_id'] = df['package_id'].astype('string')   
     df['zipcode'] = df['zipcode'].fillna(0)
-    df['zipcode'] = df['zipcode'].astype('int')  
     df['provider'] = df['provider'].fillna('None')
-    df['provider'] = df['provider'].astype('string') 
     df['assigned_area'] = df['assigned_area'].fillna(0)
-    df['assigned_area'] = df['assigned_area'].astype('int')
     df['loaded_area'] = df['loaded_area'].fillna(0)
-    df['loaded_area'] = df['loaded_area'].astype('int')
     df['station_code'] = df['station_code'].fillna(0)
-    df['station_code'] = df['station_code'].astype('int')  
     df['driver_code'] = df['driver_code'].fillna(0)
-    df['driver_code'] = df['driver_code'].astype('int')
-    
     
-    df['date'] = df['date'].astype('string')
+    # cast to the compact PLD types
+    df = apply_schema(df, PLD_SCHEMA)
     # ------------------- END FILL AND CAST ---------------------------->
     
     return df
@@ -1138,30 +1780,50 @@ def make_pld_dataframe(xlsx_file,  sheet_name, date):
     
     
 
-def index_history(df_history):
-    df = df_history.copy()
+def apply_schema(df, schema):
+    # cast every column of the schema, the dataframe is changed in place
+    # (sheet dataframes still hold package IDs, their keys are added at build)
+    for col, dtype in schema.items():
+        if col not in df.columns:
+            continue
+        elif dtype == 'category':
+            # every value seen plus the fixed categories of the column, so
+            # dataframes built from different files share their categories
+            values = df[col].astype('object')
+            categories = set(CATEGORIES.get(col, [])) | set(pd.unique(values.dropna()))
+            df[col] = pd.Categorical(values, categories=sorted(categories))
+        elif df[col].dtype != dtype:
+            df[col] = df[col].astype(dtype)
     
-    # add empty column for the order of events
-    array_order = np.full((len(df)), 0, dtype='int')
-    df.insert(loc=0, column='order', value=array_order)
+    return df
+
+
+
+
+def memory_usage(df):
+    # memory held by the dataframe in MB, strings included
+    size = df.memory_usage(index=True, deep=True).sum() / 1024**2
+    return round(size, 2)
+
+
+
+
+def index_history(df_history, index=None):
+    df = df_history.copy()
     
-    # get unique package IDs
-    pkgs = pd.unique(df['package_id'])
+    # index the packages' rows, unless an index of the dataframe was given
+    if index is None:
+        index = PackageIndex(df['package_key'].values)
     
-    # progress bar
-    pbar = tqdm(pkgs)
-    pbar.set_description("Event indexing")
+    # number each package's events in row order
+    # rows without a package ID (key -1) are left at order 0
+    array_order = index.ranks()
     
-    # loop over individual package IDs and index history entries
-    for i in pbar:
-        df_pkg = df[df['package_id'] == i]
-        pkg_indexer = 0
-        for j in df_pkg.index:
-            df.at[j, 'order'] = pkg_indexer
-            pkg_indexer += 1
+    # add the column for the order of events
+    df.insert(loc=0, column='order', value=array_order)
     
     # reorder columns
-    column_order = ['package_id', 'order', 'date', 'dow', 'type', 'station_code', 'driver_code', 'reason']
+    column_order = ['package_key', 'order', 'date', 'dow', 'type', 'station_code', 'driver_code', 'reason']
     df = df[column_order]
     
     return df
@@ -1169,32 +1831,222 @@ def index_history(df_history):
 
 
 
-def check_df_is_empty(xlsx_file, df_type):
-    # read Excel sheet
-    df = pd.read_excel(xlsx_file, df_type)
+def dedupe_packages(frames):
+    # concatenate the dataframes in build order
+    df = pd.concat(frames)
     
-    # True if df is empty, False if populated
-    is_empty = False
-    if df.empty:
-        is_empty = True
-        
-    return is_empty
+    # number each row with the position of the dataframe it came from
+    seq = np.repeat(np.arange(len(frames)), [len(f) for f in frames])
+    
+    # the first dataframe position holding each package, in one grouped pass
+    first = pd.Series(seq).groupby(df['package_key'].values).transform('min').values
+    
+    # keep packages only from the first dataframe that has them (earliest file wins)
+    # rows without a package ID (key -1) are never matched to another file
+    keep = (seq == first) | (df['package_key'].values < 0)
+    df = df[keep]
+    
+    return df
+
+
+
+
+def key_packages(sheet_frames, sheets):
+    # every package ID of the sheets' dataframes, in build order
+    frames = [f for sheet in sheets for f in sheet_frames[sheet]]
+    ids = pd.concat([f['package_id'] for f in frames]) if frames else pd.Series([], dtype='string')
+    
+    # dense keys in order of first appearance, rows without a package ID get -1
+    codes, uniques = pd.factorize(ids)
+    codes = codes.astype('int32')
+    
+    # the key dictionary, the key is the row position
+    df_keys = pd.DataFrame({'package_key' : np.arange(len(uniques), dtype='int32'), \
+                            'package_id' : pd.Series(uniques, dtype='string')})
+    
+    # swap the package IDs of every dataframe for their keys
+    keyed_frames = {}
+    start = 0
+    for sheet in sheets:
+        keyed_frames[sheet] = []
+        for f in sheet_frames[sheet]:
+            f = f.rename(columns={'package_id' : 'package_key'})
+            f['package_key'] = codes[start:start+len(f)]
+            keyed_frames[sheet].append(f)
+            start += len(f)
+    
+    return keyed_frames, df_keys
 
 
 
 
-def compare_dataframe(df_target, df_concat):
-    target_pkgs = pd.unique(df_target['package_id'])
-    concat_pkgs = pd.unique(df_concat['package_id'])
+def probe_workbook(xlsx):
+    """
+    probe_workbook(xlsx) -> inventory (dict)
+    
+    args:
+    xlsx (ExcelFile object) -> opened workbook
+    
+    returns:
+    inventory (dict) -> {sheet name : data row count} of the sheets in the workbook
+    
+    Desc:
+    Take an inventory of the workbook's sheets without parsing them. Only the
+    recorded sheet dimensions and the first data row are read. The row count
+    is -1 when the workbook does not record reliable dimensions.
+    """
+    # every sheet in the workbook, row counts unknown
+    inventory = {}
+    for sheet in xlsx.sheet_names:
+        inventory[sheet] = -1
     
-    df = df_concat.copy()
+    # only openpyxl workbooks can be probed
+    if xlsx.engine != 'openpyxl':
+        return inventory
     
-    # remove packages from the dataframe that you want to concat
-    for i in target_pkgs:
-        if i in concat_pkgs:
-            df = df[df['package_id'] != i]
+    for sheet in inventory:
+        try:
+            ws = xlsx.book[sheet]
+            max_row = ws.max_row
             
-    return df
+            # the first row after the header
+            first_row = next(ws.iter_rows(min_row=2, max_row=2, values_only=True), None)
+            has_first_row = first_row is not None and any(v is not None for v in first_row)
+            
+            if not has_first_row and (max_row is None or max_row <= 2):
+                # only a header, the sheet is empty
+                inventory[sheet] = 0
+            elif max_row is not None and max_row >= 2:
+                # rows below the header
+                inventory[sheet] = max_row - 1
+                
+        except Exception:
+            inventory[sheet] = -1
+            
+    return inventory
+
+
+
+
+def extract_workbook(file):
+    """
+    extract_workbook(file) -> frames (dict), errors (dict), timing (dict), inventory (dict)
+    
+    args:
+    file (string) -> workbook filename
+    
+    returns:
+    frames (dict) -> built dataframes keyed by sheet name
+    errors (dict) -> build error entries [df_name, file, err] keyed by sheet name
+    timing (dict) -> seconds spent on 'open', 'probe', 'parse' and 'reparse'
+    inventory (dict) -> {sheet name : data row count} from probe_workbook(), None if the workbook did not open
+    
+    Desc:
+    Open a daily workbook once and build the dataframe for every sheet in a
+    single pass. Missing sheets are logged and empty 85_SVC and 85_HIST sheets
+    are skipped from the sheet inventory, without parsing them. 'reparse' is
+    the parse time the old per-sheet build spent reading 85 sheets twice.
+    """
+    frames = {}
+    errors = {}
+    timing = {'open' : 0.0, 'probe' : 0.0, 'parse' : 0.0, 'reparse' : 0.0}
+    inventory = None
+    
+    # open the workbook a single time and take its sheet inventory
+    try:
+        start = time.perf_counter()
+        xlsx = pd.ExcelFile(file)
+        xlsx_date = capture_file_date(file)
+        timing['open'] = time.perf_counter() - start
+        
+        # the probe is not part of the open the single pass saves
+        start = time.perf_counter()
+        inventory = probe_workbook(xlsx)
+        timing['probe'] = time.perf_counter() - start
+        
+    except Exception as err:
+        # every sheet of the file fails to build
+        for sheet, df_name in WORKBOOK_SHEETS.items():
+            errors[sheet] = [df_name, file, err]
+        
+        return frames, errors, timing, inventory
+    
+    # parse every sheet from the opened workbook and build its dataframe
+    for sheet, df_name in WORKBOOK_SHEETS.items():
+        # log missing sheets without trying to read them
+        if sheet not in inventory:
+            errors[sheet] = [df_name, file, ValueError("Worksheet named '" + sheet + "' not found")]
+            continue
+            
+        # empty 85 sheets hold no packages or history
+        if (sheet == '85_SVC' or sheet == '85_HIST') and inventory[sheet] == 0:
+            continue
+            
+        try:
+            start = time.perf_counter()
+            df_sheet = xlsx.parse(sheet)
+            parse_time = time.perf_counter() - start
+            timing['parse'] += parse_time
+            
+            if sheet == 'Daily':
+                frames[sheet] = make_aggregate_dataframe(df_sheet, xlsx_date)
+            
+            elif sheet == 'SVC' or sheet == '85_SVC':
+                # the probe could not tell, check the parsed sheet
+                if sheet == '85_SVC' and df_sheet.empty:
+                    continue
+                    
+                timing['reparse'] += parse_time if sheet == '85_SVC' else 0.0
+                frames[sheet] = make_package_dataframe(df_sheet)
+            
+            elif sheet == 'HIST' or sheet == '85_HIST':
+                # the probe could not tell, check the parsed sheet
+                if sheet == '85_HIST' and df_sheet.empty:
+                    continue
+                    
+                timing['reparse'] += parse_time if sheet == '85_HIST' else 0.0
+                frames[sheet] = make_history_dataframe(df_sheet)
+            
+            else:
+                frames[sheet] = make_pld_dataframe(df_sheet, xlsx_date)
+                
+        except Exception as err:
+            errors[sheet] = [df_name, file, err]
+    
+    # release the workbook
+    xlsx.close()
+            
+    return frames, errors, timing, inventory
+
+
+
+
+def extract_workbooks(files, workers):
+    """
+    extract_workbooks(files, workers) -> results (iterator)
+    
+    args:
+    files (string list) -> workbook filenames
+    workers (int) -> number of worker processes
+    
+    returns:
+    results (iterator) -> extract_workbook() results, in file order
+    
+    Desc:
+    Extract every workbook. With more than one worker the workbooks are
+    parsed in a process pool, but the results still come back in file order
+    so the 'first file wins' package dedupe is the same as a serial build.
+    """
+    # serial extraction
+    if workers <= 1:
+        for file in files:
+            yield extract_workbook(file)
+        return
+    
+    # parallel extraction, map() keeps the file order
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(extract_workbook, files):
+            yield result
 # -------------------------------------------------------------------------------------------------------->    
 # ---------------------------------------------- END DATAFRAME FUNCTIONS --------------------------------->
 # -------------------------------------------------------------------------------------------------------->
@@ -1204,22 +2056,22 @@ def compare_dataframe(df_target, df_concat):
 # -------------------------------------------------------------------------------------------------------->
 # -------------------------------------------------- BUILD DATA ------------------------------------------>
 # -------------------------------------------------------------------------------------------------------->
-def build_data():
+def build_data(rebuild=False):
     # ------------------- initialize dataframes -------------------->
     print("\nInitializing dataframes...")
     
-    # get filenames
-    files = get_filenames()
+    # get the filenames in the date range, only those workbooks are opened
+    files = get_filenames_in_range(get_start_date(), get_end_date())
     
     # initialize all dataframes
     df_aggregate = pd.DataFrame(columns=["date", "area_counts", "pkg_counts", "pkg_returns", "pkg_missing"])
     
-    df_package = pd.DataFrame(columns=['package_id', 'service', 'signature'])
+    df_package = pd.DataFrame(columns=['package_key', 'service', 'signature'])
     
-    df_history = pd.DataFrame(columns=['package_id', 'date', 'dow', 'type', 'station_code', \
+    df_history = pd.DataFrame(columns=['package_key', 'date', 'dow', 'type', 'station_code', \
                                        'driver_code', 'reason'])
                                        
-    df_pld = pd.DataFrame(columns=['package_id', 'zipcode', 'provider', \
+    df_pld = pd.DataFrame(columns=['package_key', 'zipcode', 'provider', \
                                    'assigned_area', 'loaded_area', 'station_code', \
                                    'driver_code', 'date'])
     
@@ -1228,24 +2080,99 @@ def build_data():
     
     # list that hold errors for dataframe building
     build_error_log = []
-    # ---------------- build the aggregate dataframe --------------->   
-    # loop over the rest of the files and append aggregate data to the dataframe
-    print("\nBuilding aggregate dataframe...")
-    pbar = tqdm(files)
-    pbar.set_description('Daily')
-    for file in pbar:
-        try:
-            # load Excel file and file date
-            xlsx = pd.ExcelFile(file)
-            xlsx_date = capture_file_date(file)
+    # ----------------- extract the daily workbooks ---------------->
+    # open every file once and build the dataframes for all of its sheets
+    print("Extracting workbooks...")
+    
+    # compare the files with the last build, a rebuild parses every file
+    manifest = load_manifest()
+    entries, changed = scan_manifest(files, {} if rebuild else manifest)
+    
+    # keep the manifest entries of cataloged files outside of the date range
+    for f in get_filenames():
+        name = os.path.basename(f)
+        if name not in entries and name in manifest:
+            entries[name] = manifest[name]
+    
+    # drop sidecars of files no longer ingested or of an older parser
+    hashes = [entries[name]['hash'] for name in entries]
+    purge_sidecars(hashes)
+    
+    # load the cached dataframes of every file with a sidecar, a rebuild parses everything
+    file_results = {}
+    parse_files = []
+    for file in files:
+        frames, errors, inventory = None, None, None
+        if not rebuild:
+            frames, errors, inventory = load_sidecars(entries[os.path.basename(file)]['hash'])
             
-            # create dataframe from file and append to aggregate dataframe
-            df_xlsx = make_aggregate_dataframe(xlsx, xlsx_date)
-            df_aggregate = pd.concat([df_aggregate, df_xlsx])
+        if frames is None:
+            parse_files.append(file)
+        else:
+            # the same contents may have been cached under another filename
+            for sheet in errors:
+                errors[sheet][1] = file
+            file_results[file] = (frames, errors, inventory)
+    
+    # time spent opening, probing and parsing the workbooks
+    timing = {'open' : 0.0, 'probe' : 0.0, 'parse' : 0.0, 'reparse' : 0.0}
+    
+    # parse the added and changed workbooks with the configured number of workers
+    results = extract_workbooks(parse_files, get_workers())
+    
+    pbar = tqdm(results, total=len(parse_files))
+    pbar.set_description('Workbooks')
+    for file, (frames, errors, file_timing, inventory) in zip(parse_files, pbar):
+        # cache the file's dataframes for the next build
+        store_sidecars(entries[os.path.basename(file)]['hash'], frames, errors, inventory)
+        file_results[file] = (frames, errors, inventory)
+        
+        # collect the file timing
+        for t in timing:
+            timing[t] += file_timing[t]
+    
+    # built dataframes and errors for each sheet, in file order
+    sheet_frames = {sheet : [] for sheet in WORKBOOK_SHEETS}
+    sheet_errors = {sheet : [] for sheet in WORKBOOK_SHEETS}
+    
+    # files that are missing some of their sheets
+    missing_sheets = {}
+    
+    for file in files:
+        frames, errors, inventory = file_results[file]
+        
+        # collect the built dataframes and errors by sheet
+        for sheet in frames:
+            sheet_frames[sheet].append(frames[sheet])
+        for sheet in errors:
+            sheet_errors[sheet].append(errors[sheet])
             
-        except Exception as err:
-                df_name = 'df_aggregate (Daily)'
-                build_error_log.append([df_name, file, err])
+        # check the sheet inventory, a workbook that did not open has none
+        # (its build errors are logged already)
+        if inventory is None:
+            continue
+        missing = [sheet for sheet in WORKBOOK_SHEETS if sheet not in inventory]
+        if missing:
+            missing_sheets[file] = missing
+    
+    # keep the error log grouped by sheet
+    for sheet in WORKBOOK_SHEETS:
+        build_error_log.extend(sheet_errors[sheet])
+    
+    # show the files with missing sheets right away
+    for file in missing_sheets:
+        print("Missing sheets in", file + ":", ', '.join(missing_sheets[file]))
+    
+    # completion message
+    print("Workbook extraction complete.", end='\n\n')
+    # ----------------- workbook extraction complete --------------->
+    
+    
+    # ---------------- build the aggregate dataframe --------------->   
+    # append aggregate data of all the files to the dataframe
+    print("\nBuilding aggregate dataframe...")
+    df_aggregate = pd.concat([df_aggregate] + sheet_frames['Daily'])
+    df_aggregate['date'] = df_aggregate['date'].astype('int32')
     
     # reset indices for the dataframe
     df_aggregate = df_aggregate.reset_index(drop=True)
@@ -1255,50 +2182,27 @@ def build_data():
     # ----------------- aggregate dataframe complete --------------->
     
     
+    # ----------------- key the package IDs ------------------------>
+    # number every package ID once, in build order, and use the int32 keys
+    # in place of the IDs from here on (package_keys.pkl translates them back)
+    print("Keying package IDs...")
+    sheets = ['SVC', '85_SVC', 'HIST', '85_HIST', 'PLD', '85']
+    keyed_frames, df_keys = key_packages(sheet_frames, sheets)
+    sheet_frames.update(keyed_frames)
+    
+    # completion message
+    print("Package keys complete:", len(df_keys), end='\n\n')
+    # ----------------- package keys complete ---------------------->
+    
+    
     # ----------------- build the package dataframe ---------------->
-    # loop over the rest of the files and append package data to the dataframe
+    # append package data to the dataframe, the first file with a package wins
     print("Building package dataframe...")
-    # process for PLD data
-    pbar = tqdm(files)
-    pbar.set_description('SVC')
-    for file in pbar:
-        try:
-            # load Excel file and file date
-            xlsx = pd.ExcelFile(file)
-            
-            # create dataframe from file and append to package dataframe
-            df_xlsx = make_package_dataframe(xlsx, 'SVC')
-            df_xlsx = compare_dataframe(df_package, df_xlsx)
-            df_package = pd.concat([df_package, df_xlsx])
-        
-        except Exception as err:
-                df_name = 'df_package (SVC)'
-                build_error_log.append([df_name, file, err])
-                
-    # process for 85 data
-    pbar = tqdm(files)
-    pbar.set_description('85_SVC')
-    for file in pbar:     
-        try:
-            # load Excel file and file date
-            xlsx = pd.ExcelFile(file)
-            
-            # check to see if the dataframe is empty first
-            is_empty = check_df_is_empty(xlsx, '85_SVC')
-            
-            if is_empty != True:
-                # create dataframe from file and append to package dataframe
-                df_xlsx = make_package_dataframe(xlsx, '85_SVC')
-                df_xlsx = compare_dataframe(df_package, df_xlsx)
-                df_package = pd.concat([df_package, df_xlsx])
-        
-        except Exception as err:
-                df_name = 'df_package (85_SVC)'
-                build_error_log.append([df_name, file, err])
+    df_package = dedupe_packages([df_package] + sheet_frames['SVC'] + sheet_frames['85_SVC'])
                 
-                    
     # drop any duplicate in the dataframe
-    df_package = df_package.drop_duplicates(subset=['package_id'])
+    df_package = df_package.drop_duplicates(subset=['package_key'])
+    df_package['package_key'] = df_package['package_key'].astype('int32')
     
     # reset indices for the dataframe
     df_package = df_package.reset_index(drop=True)
@@ -1309,44 +2213,9 @@ def build_data():
     
     
     # ----------------- build the history dataframe ---------------->   
-    # loop over the rest of the files and append history data to the dataframe
+    # append history data to the dataframe, the first file with a package wins
     print("Building history dataframe...")
-    pbar = tqdm(files)
-    pbar.set_description('HIST')
-    for file in pbar:
-        try:
-            # load Excel file and file date
-            xlsx = pd.ExcelFile(file)
-            
-            # create dataframe from file and append to history dataframe
-            df_xlsx = make_history_dataframe(xlsx, 'HIST')
-            df_xlsx = compare_dataframe(df_history, df_xlsx)
-            df_history = pd.concat([df_history, df_xlsx])
-        
-        except Exception as err:
-                df_name = 'df_history (HIST)'
-                build_error_log.append([df_name, file, err])
-                
-    # process for 85 data
-    pbar = tqdm(files)
-    pbar.set_description('85_HIST')
-    for file in pbar:     
-        try:
-            # load Excel file and file date
-            xlsx = pd.ExcelFile(file)
-            
-            # check to see if the dataframe is empty first
-            is_empty = check_df_is_empty(xlsx, '85_HIST')
-            
-            if is_empty != True:
-                # create dataframe from file and append to package dataframe
-                df_xlsx = make_history_dataframe(xlsx, '85_HIST')
-                df_xlsx = compare_dataframe(df_history, df_xlsx)
-                df_history = pd.concat([df_history, df_xlsx])
-        
-        except Exception as err:
-            df_name = 'df_history (85_HIST)'
-            build_error_log.append([df_name, file, err])
+    df_history = dedupe_packages([df_history] + sheet_frames['HIST'] + sheet_frames['85_HIST'])
     
     # drop any duplicate in the dataframe
     df_history = df_history.drop_duplicates()
@@ -1357,46 +2226,20 @@ def build_data():
     # !!! HISTORY EVENT INDEXING HERE !!!
     df_history = index_history(df_history)
     
+    # the concatenation widens the compact types again, cast them back
+    history_memory = memory_usage(df_history)
+    df_history = apply_schema(df_history, HISTORY_SCHEMA)
+    print("df_history memory (MB):", history_memory, "->", memory_usage(df_history))
+    
     # completion message
     print("History dataframe complete.", end='\n\n')
     # ----------------- history dataframe complete ----------------->
     
     
     # ----------------- build the PLD dataframe -------------------->
-    # loop over the rest of the files and append history data to the dataframe
+    # append PLD and 85 data of all the files to the dataframe
     print("Building PLD dataframe...")
-    pbar = tqdm(files)
-    pbar.set_description('PLD')
-    for file in pbar:
-        try:
-            # load Excel file and file date
-            xlsx = pd.ExcelFile(file)
-            xlsx_date = capture_file_date(file)
-            
-            # create dataframe from file and append to history dataframe
-            df_xlsx = make_pld_dataframe(xlsx, 'PLD', xlsx_date)
-            df_pld = pd.concat([df_pld, df_xlsx])
-            
-        except Exception as err:
-            df_name = 'df_pld (PLD)'
-            build_error_log.append([df_name, file, err])
-        
-    # build 85 data
-    pbar = tqdm(files)
-    pbar.set_description('85')
-    for file in pbar:
-        try:
-            # load Excel file and file date
-            xlsx = pd.ExcelFile(file)
-            xlsx_date = capture_file_date(file)
-            
-            # create dataframe from file and append to history dataframe
-            df_xlsx = make_pld_dataframe(xlsx, '85', xlsx_date)
-            df_pld = pd.concat([df_pld, df_xlsx])
-            
-        except Exception as err:
-            df_name = 'df_pld (85)'
-            build_error_log.append([df_name, file, err])
+    df_pld = pd.concat([df_pld] + sheet_frames['PLD'] + sheet_frames['85'])
                 
     # drop any duplicate in the dataframe
     df_pld = df_pld.drop_duplicates()
@@ -1404,6 +2247,11 @@ def build_data():
     # reset indices for the dataframe
     df_pld = df_pld.reset_index(drop=True)
     
+    # the concatenation widens the compact types again, cast them back
+    pld_memory = memory_usage(df_pld)
+    df_pld = apply_schema(df_pld, PLD_SCHEMA)
+    print("df_pld memory (MB):", pld_memory, "->", memory_usage(df_pld))
+    
     # completion message
     print("PLD dataframe complete.", end='\n\n')
     # ----------------- PLD dataframe complete --------------------->
@@ -1423,14 +2271,24 @@ def build_data():
     set_dataframe(df_package, 'package')
     set_dataframe(df_history, 'history')
     set_dataframe(df_pld, 'pld')
+    set_dataframe(df_keys, 'keys')
     
     # save the dataframes in a file
     df_save_success = store_dataframes()
     
+    # record the ingested files for the next build, and the packages they
+    # touched for the next merger run
+    if df_save_success:
+        store_manifest(entries)
+        store_touched(update_touched(load_touched(), files, changed, file_results))
+    
     # Get the error counts
     build_error_count = len(build_error_log)
     #merge_error_count = len(merge_error_log)
     
+    # opening each file once per sheet cost one extra open for every other sheet
+    saved_time = timing['open'] * (len(WORKBOOK_SHEETS) - 1) + timing['reparse']
+    
     # store the error logs in our global list
     set_error_log(build_error_log, 'build')
     #set_error_log(merge_error_log, 'merge')
@@ -1446,6 +2304,12 @@ def build_data():
     print("Total sample size (Packages):", len(df_package))
     print("Build errors:", build_error_count)
     #print("Merge errors:", merge_error_count, end='\n')
+    print("Workbooks added or changed:", len(changed))
+    print("Workbooks parsed:", len(parse_files), "of", len(files))
+    print("Workbook open time (s):", round(timing['open'], 2))
+    print("Sheet probe time (s):", round(timing['probe'], 2))
+    print("Sheet parse time (s):", round(timing['parse'], 2))
+    print("Open/parse time saved by single pass (s):", round(saved_time, 2))
     print("Dataframes successfully saved:", df_save_success)
     print("Error logs successfully saved:", err_save_success, end='\n\n')
     
@@ -1468,94 +2332,71 @@ def history_merge_pld():
     
     # new dataframe for merging
     merged_dataframe = df_history.copy()
-
-    # all the unique package IDs from the history dataframe
-    history_idx = pd.unique(df_history['package_id'])
-    
-    # add PLD columns to the history dataframe
-    pld_columns = df_pld[['provider', 'assigned_area', 'loaded_area', 'zipcode']].columns
     
     # build blank columns for PLD data
-    array_provider = np.full((len(merged_dataframe)), '', dtype='str')
-    array_assigned_area = np.full((len(merged_dataframe)), 0, dtype='int')
-    array_loaded_area = np.full((len(merged_dataframe)), 0, dtype='int')
-    array_zipcode = np.full((len(merged_dataframe)), 0, dtype='int')
+    array_provider = np.full((len(merged_dataframe)), '', dtype='object')
+    array_assigned_area = np.full((len(merged_dataframe)), 0, dtype='int16')
+    array_loaded_area = np.full((len(merged_dataframe)), 0, dtype='int16')
+    array_zipcode = np.full((len(merged_dataframe)), 0, dtype='int32')
+    
+    # ------------------------------------------- MERGING CODE ------------------------------>
+    print("Merging df_history and df_pld...")
+    
+    # the first history row of every package and date takes the PLD data
+    df_first = pd.DataFrame({'package_key' : df_history['package_key'].values, \
+                             'date' : df_history['date'].values, \
+                             'row' : np.arange(len(df_history))})
+    df_first = df_first[df_first['package_key'].values >= 0]
+    df_first = df_first.drop_duplicates(subset=['package_key', 'date'])
+    
+    # only PLD rows of packages with a history are merged
+    df_join = df_pld[df_pld['package_key'].isin(df_first['package_key']).values]
+    
+    # join the PLD rows onto the first history rows, PLD rows keep their order
+    df_join = df_join.merge(df_first, how='left', on=['package_key', 'date'], sort=False)
+    matched = df_join['row'].notna().values
+    
+    # a later PLD row for the same history row overwrites the earlier ones
+    df_matched = df_join[matched].drop_duplicates(subset=['row'], keep='last')
+    rows = df_matched['row'].values.astype('int64')
+    
+    # merge data into the blank columns
+    array_provider[rows] = df_matched['provider'].astype('object').values
+    array_assigned_area[rows] = df_matched['assigned_area'].values
+    array_loaded_area[rows] = df_matched['loaded_area'].values
+    array_zipcode[rows] = df_matched['zipcode'].values
+    
+    # PLD rows without a history entry on their date (anti-join) are the merge errors
+    # they are listed by package, in the order the packages first appear in history
+    df_keys = get_dataframe('keys')
+    merge_error_log = df_join[~matched].drop(columns='row')
+    
+    history_order = pd.Index(pd.unique(df_first['package_key'].values))
+    sort_order = history_order.get_indexer(merge_error_log['package_key'].values)
+    merge_error_log = merge_error_log.iloc[np.argsort(sort_order, kind='stable')]
+    
+    # the key is the row of the package key dictionary
+    package_ids = df_keys['package_id'].values[merge_error_log['package_key'].values]
+    merge_error_log.insert(loc=0, column='package_id', value=package_ids)
+    merge_error_log = merge_error_log.reset_index(drop=True)
+    errors = len(merge_error_log)
     
     # insert new columns into package's history dataframe
     merged_dataframe.insert(loc=len(merged_dataframe.columns), column='provider', value=array_provider)
     merged_dataframe.insert(loc=len(merged_dataframe.columns), column='assigned_area', value=array_assigned_area)
     merged_dataframe.insert(loc=len(merged_dataframe.columns), column='loaded_area', value=array_loaded_area)
     merged_dataframe.insert(loc=len(merged_dataframe.columns), column='zipcode', value=array_zipcode)
-    
-    # ------------------------------------------- MERGING CODE ------------------------------>
-    print("Merging df_history and df_pld...")
-    
-    # error tracking for the loop below
-    merge_error_log = []
-    errors = 0
-    pkg_error = False
-    
-    pbar = tqdm(history_idx)
-    pbar.set_description('Errors 0')
-    # loop over all the individual packages in history
-    for i in pbar:
-        # collect and reset error
-        if pkg_error == True:           
-            pkg_error = False
-            pbar_error = 'Errors ' + str(errors)
-            pbar.set_description(pbar_error)
-    
-        # get the package's history
-        pkg_hist = df_history[df_history['package_id'] == i]
-        
-        # get the package's pld data
-        pkg_pld = df_pld[df_pld['package_id'] == i]
-        
-        # for each entry for the package in the PLD dataframe
-        for pld_row in pkg_pld.itertuples():
-            
-            # get the date for the PLD entry
-            date = pld_row.date
-          
-            try:
-                # get dataframe from package's history for the PLD date
-                pkg_hist_date = pkg_hist[pkg_hist['date'] == date]
-                
-                # get the first entry for date in package's history
-                index = pkg_hist_date.index[0]
-                
-                # merge data into the dataframe
-                merged_dataframe.at[index, 'provider'] = pld_row.provider
-                merged_dataframe.at[index, 'assigned_area'] = pld_row.assigned_area
-                merged_dataframe.at[index, 'loaded_area'] = pld_row.loaded_area
-                merged_dataframe.at[index, 'zipcode'] = pld_row.zipcode
-                
-            except Exception as err:
-                # set package error to true
-                pkg_error = True
-                errors += 1
-                
-                # log error
-                merge_error_log.append([i, date, err])                
     # --------------------------------------- END MERGING CODE ------------------------------>
     
     # ----------------------------- CLEANUP AND TYPE CASTING -------------------------------->
-    # drop missing values
+    # drop missing values, rows without a package ID (key -1) included
     merged_dataframe = merged_dataframe.dropna()
+    merged_dataframe = merged_dataframe[merged_dataframe['package_key'].values >= 0]
     
     # type casting for columns
+    merged_memory = memory_usage(merged_dataframe)
     merged_dataframe.index = merged_dataframe.index.astype('int')    
-    merged_dataframe['package_id'] = merged_dataframe['package_id'].astype('string')    
-    merged_dataframe['order'] = merged_dataframe['order'].astype('int')    
-    merged_dataframe['date'] = merged_dataframe['date'].astype('string')   
-    merged_dataframe['dow'] = merged_dataframe['dow'].astype('string')   
-    merged_dataframe['station_code'] = merged_dataframe['station_code'].astype('int')   
-    merged_dataframe['driver_code'] = merged_dataframe['driver_code'].astype('int')   
-    merged_dataframe['reason'] = merged_dataframe['reason'].astype('int')            
-    merged_dataframe['zipcode'] = merged_dataframe['zipcode'].astype('int')    
-    merged_dataframe['provider'] = merged_dataframe['provider'].astype('string')    
-    merged_dataframe['assigned_area'] = merged_dataframe['assigned_area'].astype('int')
-    merged_dataframe['loaded_area'] = merged_dataframe['loaded_area'].astype('int')
+    merged_dataframe = apply_schema(merged_dataframe, MERGED_SCHEMA)
     # ------------------------- END CLEANUP AND TYPE CASTING -------------------------------->
     
     # set and save dataframe
@@ -1571,6 +2412,7 @@ def history_merge_pld():
     print("----------------------------------")
     print("Merging completed.")
     print("Merge errors:", errors)
+    print("df_merged_history memory (MB):", merged_memory, "->", memory_usage(merged_dataframe))
     print("\n\n")            
     print("Dataframe saved successfully:", save_success)
     print("Error log saved successfully:", save_log_success)
@@ -1587,25 +2429,42 @@ def history_merge_pld():
 # -------------------------------------------------------------------------------------------------------->
 # ------------------------------------------ CLEANING FUNCTIONS ------------------------------------------>
 # -------------------------------------------------------------------------------------------------------->
+def make_code_lookup(recode_dict):
+    # lookup array indexed by raw code, codes not in a recode map to 0
+    size = max(max(v) for v in recode_dict.values()) + 1
+    lookup = np.zeros(size, dtype='int8')
+    for k, v in recode_dict.items():
+        for vv in v:
+            lookup[vv] = k
+            
+    return lookup
+    
+    
+    
+    
+def lookup_codes(codes, lookup):
+    # gather the recoded values, codes outside of the lookup array are 0
+    codes = np.asarray(codes, dtype='int64')
+    inside = (codes >= 0) & (codes < len(lookup))
+    recoded = np.where(inside, lookup[np.clip(codes, 0, len(lookup)-1)], 0)
+    
+    return recoded.astype(lookup.dtype)
+    
+    
+    
+    
 def recode_history(df_history):
     # make a copy of the history dataframe
     df = df_history.copy()
     
     # Sub recodes List
-    sub_recode_dict = {1: 1, 2: 2, 3: 3, 4: 4, 5: 5, 6: 73, 7: 74}
+    sub_recode_dict = {1: {1}, 2: {2}, 3: {3}, 4: {4}, 5: {5}, 6: {73}, 7: {74}}
     
-    # Use default_dict so that codes other than recodes default to 0
-    default_sub_dict = defaultdict(lambda: 0)
-    for k, v in sub_recode_dict.items():
-        default_sub_dict[v] = k
-        
-    # do the sub recoding
-    for row in df_history.itertuples():
-        if row.driver_code == 2:
-            new_code = default_sub_dict[row.reason]
-            df.at[row.Index, 'reason'] = new_code
-        else:
-            df.at[row.Index, 'reason'] = 0
+    # do the sub recoding, only driver code 2 has a reason
+    sub_lookup = make_code_lookup(sub_recode_dict)
+    driver_codes = df['driver_code'].to_numpy(dtype='int64')
+    reasons = lookup_codes(df['reason'].to_numpy(dtype='int64'), sub_lookup)
+    df['reason'] = np.where(driver_codes == 2, reasons, 0).astype('int8')
 
 
     # Recodes List
@@ -1613,15 +2472,10 @@ def recode_history(df_history):
                    4: {33, 35, 42, 43, 51, 52, 53, 54, 56, 63, 67, 68}, 5: {12, 16, 27, 37},
                    6: {2, 3, 17}, 7: {85}, 8: {6, 81}, 9: {10}}
 
-    # Use default_dict so that codes other than recodes default to 0
-    default_dict = defaultdict(lambda: 0)
-    for k, v in recode_dict.items():
-        for vv in v:
-            default_dict[vv] = k
-
     # Do the recoding
+    lookup = make_code_lookup(recode_dict)
     for col in ["driver_code", "station_code"]:
-        df[col] = df[col].astype(int).apply(lambda x: default_dict[x])
+        df[col] = lookup_codes(df[col].to_numpy(dtype='int64'), lookup)
 
     return df
   
@@ -1634,8 +2488,8 @@ def package_align_history(df_package, df_history):
     df_history_aligned = df_history.copy()
     
     # get the unique package IDs in both df_package and df_history
-    hist_ids = pd.unique(df_history['package_id'])
-    package_ids = pd.unique(df_package['package_id'])
+    hist_ids = pd.unique(df_history['package_key'])
+    package_ids = pd.unique(df_package['package_key'])
     
     # for every unique package id in df_package
     pbar = tqdm(package_ids)
@@ -1643,7 +2497,7 @@ def package_align_history(df_package, df_history):
     for pkg in pbar:
         # remove packages from df_package that are not in the df_history
         if pkg not in hist_ids:
-            index = df_package_aligned[df_package_aligned['package_id'] == pkg].index
+            index = df_package_aligned[df_package_aligned['package_key'] == pkg].index
             df_package_aligned = df_package_aligned.drop(index, axis=0)
             
     # for every unique package id in df_history
@@ -1652,7 +2506,7 @@ def package_align_history(df_package, df_history):
     for pkg in pbar:
         # remove packages from df_history that are not in the df_package
         if pkg not in package_ids:
-            indices = df_history_aligned[df_history_aligned['package_id'] == pkg].index        
+            indices = df_history_aligned[df_history_aligned['package_key'] == pkg].index        
             df_history_aligned = df_history_aligned.drop(indices, axis=0)
     
     # reset the indices for both dataframes
@@ -1664,114 +2518,71 @@ def package_align_history(df_package, df_history):
     
     
     
-def remove_empty_pkg(df_history):
-    # get a copy of the history dataframe
-    df = df_history.copy()
-    
-    # get all the unique package IDs
-    history_idx = pd.unique(df_history['package_id'])
+def filter_packages(df_history, index=None):
+    # index the packages' rows, unless an index of the dataframe was given
+    if index is None:
+        index = PackageIndex(df_history['package_key'].values)
     
-    # for every unique package in the history dataframe
-    for i in tqdm(history_idx):
-        # get the history for the package
-        df_pkg = df_history[df_history['package_id'] == i]
-        
-        # if only entry or less is present in the package's history, remove package
-        if len(df_pkg) <= 1:
-            indices = df_pkg.index
-            df = df.drop(indices, axis=0)
-            
-    # reset the dataframe indices
-    df = df.reset_index(drop=True)
+    # every package's rows sorted together, in row order (CSR layout)
+    rows = index.order
+    starts = index.offsets[:-1]
+    sizes = index.sizes()
     
-    return df
+    # get the date ranges as yyyymmdd integers like the history dates
+    start_date = date_to_int(get_start_date())
+    end_date = date_to_int(get_end_date())
+    dates = df_history['date'].values[rows]
     
+    # if only entry or less is present in the package's history
+    empty = sizes <= 1
     
+    # if package contains dates not in data range
+    out_of_range = np.maximum.reduceat((dates < start_date) | (dates > end_date), starts)
     
+    # if the package 'order' index 0 is not present
+    no_first = ~np.maximum.reduceat(df_history['order'].values[rows] == 0, starts)
     
-def remove_history_dates(df_history):
-    # get a copy of the history dataframe
-    df = df_history.copy()
-
-    # get the date ranges
-    start_date = get_start_date()
-    end_date = get_end_date()
+    # count the rejected packages under the first rule they break, the order
+    # the rules used to run in
+    counts = {'history of one row or less' : int(empty.sum()), \
+              'dates outside of the date range' : int((out_of_range & ~empty).sum()), \
+              'missing order 0' : int((no_first & ~empty & ~out_of_range).sum())}
     
-    # get all the unique package IDs
-    history_idx = pd.unique(df_history['package_id'])
+    # remove the rejected packages with one mask, rows without a package are kept
+    keep = np.full((len(df_history)), True)
+    keep[rows[np.repeat(empty | out_of_range | no_first, sizes)]] = False
+    df = df_history[keep]
     
-    # for every unique package in the history dataframe
-    for i in tqdm(history_idx):
-        # get the history for the package
-        df_pkg = df_history[df_history['package_id'] == i]
-        
-        # check all the dates for the package
-        for d in df_pkg['date']:           
-            pkg_date = str_to_date(d)   #datetime date from package history
-            
-            # if package contains dates not in data range, remove package
-            if pkg_date < start_date or pkg_date > end_date:
-                indices = df_pkg.index
-                df = df.drop(indices, axis=0)
-                break
-                
     # reset the dataframe indices
     df = df.reset_index(drop=True)
-                
-    return df
     
-    
-    
-    
-def remove_history_order(df_history):
-    # get a copy of the history dataframe
-    df = df_history.copy()
+    return df, counts
 
-    # get the unique package IDs
-    history_idx = pd.unique(df_history['package_id'])
-    
-    # if the package 'order' index 0 is not present, remove package
-    for i in tqdm(history_idx):
-        # df of the current package's history
-        df_pkg = df_history[df_history['package_id'] == i]
-               
-        if 0 not in df_pkg['order'].values:
-            indices = df_pkg.index
-            df = df.drop(indices, axis=0)
-            
-    # reset the dataframe indices
-    df = df.reset_index(drop=True)
-    
-    return df
-    
-    
+
+
+
+def truncate_pkg_history(df_history, index=None):
+    # index the packages' rows, unless an index of the dataframe was given
+    if index is None:
+        index = PackageIndex(df_history['package_key'].values)
     
+    # every package's rows sorted together, in row order (CSR layout)
+    rows = index.order
+    starts = index.offsets[:-1]
+    delivery = (df_history['type'] == 'Delivery').values[rows]
+    order = df_history['order'].values[rows]
     
-
-def truncate_pkg_history(df_history):
-    # get a copy of the history dataframe
-    df = df_history.copy()
+    # the last 'Delivery' status row of every package, -1 if there is none
+    positions = np.where(delivery, np.arange(len(rows)), -1)
+    last = np.maximum.reduceat(positions, starts)
     
-    # get the unique package IDs
-    history_idx = pd.unique(df_history['package_id'])
+    # get the last order index with 'Delivery' status, packages without any keep all their rows
+    last_delivery = np.where(last >= 0, order[last], np.iinfo('int64').max)
     
-    for i in tqdm(history_idx):
-        # df of the current package's history
-        df_pkg = df_history[df_history['package_id'] == i]
-        
-        # if there is any 'Delivery' status for the package
-        if 'Delivery' in df_pkg['type'].values:
-            #get order indices of when the package has 'Delivery' status
-            pkg_delivery = df_pkg.query("type=='Delivery'")['order'].values
-            
-            # get the last order index with 'Delivery' status
-            last_delivery = pkg_delivery[len(pkg_delivery)-1]
-            
-            # get any indices that might occur after last 'Delivery' status
-            index_after_delivery = df_pkg[df_pkg['order'] > last_delivery].index
-            
-            # remove those indices after the last 'Delivery' status
-            df = df.drop(index_after_delivery, axis=0)
+    # remove the rows that occur after the last 'Delivery' status with one mask
+    keep = np.full((len(df_history)), True)
+    keep[rows[order > np.repeat(last_delivery, index.sizes())]] = False
+    df = df_history[keep]
     
     # reset the dataframe indices
     df = df.reset_index(drop=True)
@@ -1995,13 +2806,13 @@ def fix_zipcode_provider(df_history):
     #<----------------------ZIPCODES/PROVIDERS COMPLETE------------------------>
     
     # get unique package IDs
-    df_idx = pd.unique(df_history['package_id'])
+    df_idx = pd.unique(df_history['package_key'])
 
     # remove packages with their provider as 'None'
     pbar = tqdm(df_idx)
     pbar.set_description("Removing 'None' Provider")
     for i in pbar:
-        df_pkg = df[df['package_id'] == i]
+        df_pkg = df[df['package_key'] == i]
         
         if 'None' in df_pkg['provider'].values:
             indices = df_pkg.index
@@ -2012,7 +2823,7 @@ def fix_zipcode_provider(df_history):
     pbar = tqdm(df_idx)
     pbar.set_description("Removing No Zipcode")
     for i in pbar:
-        df_pkg = df[df['package_id'] == i]
+        df_pkg = df[df['package_key'] == i]
         
         zips = pd.unique(df_pkg['zipcode'])
         zips = [x for x in zips if x != 0]
@@ -2024,43 +2835,49 @@ def fix_zipcode_provider(df_history):
     # reset the index
     df = df.reset_index(drop=True)
     
-    return df 
+    # the tables built from the whole history, a package's imputed values only
+    # change with the entries it looks up
+    tables = {'zip_area' : zip_area_dict, 'area_provider' : area_provider_dict, \
+              'area_zip' : area_zip_dict, 'provider_zip' : provider_zip_dict}
     
+    return df, tables
     
     
     
-def type_to_status(df_history):
-    # make a copy of the history dataframe
-    df = df_history.copy()
     
-    # rename the columns
-    df = df.rename(columns={'type' : 'status'})
+def type_to_status(df_history, index=None):
+    # index the packages' rows, unless an index of the dataframe was given
+    if index is None:
+        index = PackageIndex(df_history['package_key'].values)
     
-    # change 'Status Code' value to 'code'
-    df['status'] = df['status'].str.replace('Status Code', 'S')
+    # rename the columns, the copy of the history dataframe
+    df = df_history.rename(columns={'type' : 'status'})
+    status = df['status'].astype('category')
     
-    # change 'Delivery' value to 'delivery'
-    df['status'] = df['status'].str.replace('Delivery', 'D')
+    # change 'Status Code' value to 'code' and 'Delivery' value to 'delivery'
+    # in the categories, types that end up the same share one category
+    categories = status.cat.categories.astype('str')
+    categories = categories.str.replace('Status Code', 'S').str.replace('Delivery', 'D')
+    category_codes, categories = pd.factorize(categories)
     
-    # get all the unique package IDs
-    history_idx = pd.unique(df_history['package_id'])
+    codes = status.cat.codes.values
+    codes = np.where(codes >= 0, category_codes[codes], -1)
+    categories = list(categories) + [c for c in ['D', 'X'] if c not in categories]
     
-    # add a no delivery status as 'X' if no delivery status
-    for i in tqdm(history_idx):
-        # dataframe of the current package
-        df_pkg = df[df['package_id'] == i]
-        
-        # all the status values of the current package
-        status = df_pkg['status'].values
-        
-        # add no delivery status 'X' if delivery status not present
-        if 'D' not in status:
-            # get the index of the last entry for the package
-            indices = df_pkg.index
-            index = indices[len(indices)-1]
-            
-            # set no delivery status in our dataframe
-            df.at[index, 'status'] = 'X'
+    # every package's rows sorted together, in row order (CSR layout)
+    rows = index.order
+    starts = index.offsets[:-1]
+    last_rows = rows[index.offsets[1:] - 1]
+    
+    # add a no delivery status as 'X' on the last entry of every package
+    # without a delivery status
+    has_delivery = np.maximum.reduceat(codes[rows] == categories.index('D'), starts)
+    codes[last_rows[~has_delivery]] = categories.index('X')
+    
+    # the statuses are categories like the types were
+    status = pd.Categorical.from_codes(codes, categories=categories)
+    status = status.remove_unused_categories()
+    df['status'] = status.reorder_categories(sorted(status.categories))
             
     return df
 # -------------------------------------------------------------------------------------------------------->
@@ -2084,56 +2901,55 @@ def clean_data():
     
     # remove and resolve non-delivery area zipcodes
     print("Process #1: Fixing zipcodes and Providers...")
-    df_history = fix_zipcode_provider(df_history)
+    df_merged = df_history
+    df_history, tables = fix_zipcode_provider(df_history)
     print("Process #1 completed.", end='\n\n') 
     
-    # remove packages that don't have a history
-    print("Process #2: Removing packages with unusable histories...")
-    df_history = remove_empty_pkg(df_history)
+    # remove packages that don't have a usable history: one entry or less, dates
+    # outside of the start and end date range, or incorrect history ordering
+    # (missing 0th index, some packages had weird 'Delivery' at first index with
+    # date 9999/99/99 and are now missing the first index)
+    print("Process #2: Removing packages with unusable histories, dates or ordering...")
+    df_history, counts = filter_packages(df_history, PackageIndex(df_history['package_key'].values))
+    for rule in counts:
+        print("Packages removed for", rule + ":", counts[rule])
     print("Process #2 completed.", end='\n\n')
     
-    # enforce date range of all packages to be within the start and end date range
-    print("Process #3: Enforcing date range for the history dataframe...")
-    df_history = remove_history_dates(df_history)
-    print("Process #3 completed.", end='\n\n')
-    
-    # remove packages that have incorrect history ordering (missing 0th index)
-    # some packages had weird 'Delivery' at first index, with date 9999/99/99
-    # those packages are now missing the first index, we need to remove them
-    print("Process #4: Removing packages with ordering issues...")
-    df_history = remove_history_order(df_history)
-    print("Process #4 completed.", end='\n\n')
-    
     # truncate package histories to not show history after 'Delivery' status
-    print("Process #5: Truncating package histories after 'Delivery' status...")
-    df_history = truncate_pkg_history(df_history)
-    print("Process #5 completed.", end='\n\n')    
+    print("Process #3: Truncating package histories after 'Delivery' status...")
+    df_history = truncate_pkg_history(df_history, PackageIndex(df_history['package_key'].values))
+    print("Process #3 completed.", end='\n\n')    
     
     # convert the codes in the history dataframe
-    print("Process #6: Recoding the codes...")
+    print("Process #4: Recoding the codes...")
     df_history = recode_history(df_history)
-    print("Process #6 completed.", end='\n\n')     
+    print("Process #4 completed.", end='\n\n')     
     
     # fix the loaded_area attribute in history dataframe
-    print("Process #7: Fixing loaded_area digits in history dataframe...")
+    print("Process #5: Fixing loaded_area digits in history dataframe...")
     df_history = fix_area_digits(df_history)
-    print("Process #7 completed.", end='\n\n')    
+    print("Process #5 completed.", end='\n\n')    
     
     # modify history 'type' attribute to show status
-    print("Process #8: Transforming 'type' attribute and adding no delivery status...")
-    df_history = type_to_status(df_history)
-    print("Process #8 completed.", end='\n\n')
+    print("Process #6: Transforming 'type' attribute and adding no delivery status...")
+    df_history = type_to_status(df_history, PackageIndex(df_history['package_key'].values))
+    print("Process #6 completed.", end='\n\n')
     
     # we want to align df_package and df_history to have the same packages in them
-    print("Process #9: Aligning the package and history dataframes...")
+    print("Process #7: Aligning the package and history dataframes...")
     df_package, df_history = package_align_history(df_package, df_history)
-    print("Process #9 completed.", end='\n\n')
+    print("Process #7 completed.", end='\n\n')
     
     # set and save dataframe
     set_dataframe(df_package, 'package')
     set_dataframe(df_history, 'merged')
     save_success = store_dataframes()
     
+    # the packages whose imputed values moved with the new history are touched
+    touched = load_touched()
+    if touched is not None:
+        store_touched(update_imputed(touched, tables, df_merged, get_dataframe('keys')))
+    
     print("----------------------------------")
     print("---------CLEAN SUCCESS------------")
     print("----------------------------------")
@@ -2155,6 +2971,16 @@ def main(args):
     # check if custom file path is given
     if len(args) > 1:
         set_path(args[1], 'data')
+        
+    # check if a worker count is given
+    if len(args) > 2:
+        try:
+            set_workers(args[2])
+        except ValueError:
+            print("Invalid worker count:", args[2])
+            print("Run script as follows:")
+            print("python preprocessor.py [data path] [number of workers]")
+            sys.exit()
     
     # check file paths
     check_path()
@@ -2175,9 +3001,10 @@ def main(args):
         print("Please add your data to the current data directory:", data_path)
         sys.exit()
 
-    # attempt to get the range of dates from the files
-    start_date = capture_file_date(files[0])
-    end_date = capture_file_date(files[len(files)-1]) 
+    # get the range of dates from the file catalog (sorted by date)
+    catalog = get_catalog()
+    start_date = catalog[0][0]
+    end_date = catalog[len(catalog)-1][0]
     
     set_start_date(start_date)
     set_end_date(end_date)